@@ -0,0 +1,69 @@
+"""
+Throughput benchmark for AuditOps.parse_logs
+
+Compares the registry based dispatch against the previous approach of building
+every audit parser for each log line and trying them one after another.
+Run: python -m benchmarks.audit_parse --lines 2000000
+"""
+import argparse
+import time
+
+from datetime import datetime
+from typing import Callable, List
+from operators.audit_trail import audit_ops
+from benchmarks import synthetic
+
+
+def legacy_parse(ops: audit_ops.AuditOps, log_messages: List[str]) -> int:
+    ''' Parse loop as it was before the audit registry, returns row count '''
+    rows = 0
+    action_id = 1
+    for log in log_messages:
+        is_audit_record = False
+        for adt in ops.auditors:
+            adt.log_message = log
+            audit_details = adt.extract_audit_details(str(action_id))
+            if audit_details:
+                is_audit_record = True
+                break
+
+        if is_audit_record:
+            action_id += 1
+            rows += len(audit_details)
+
+    return rows
+
+
+def timed(label: str, func: Callable, line_count: int) -> float:
+    ''' Run func and print its throughput '''
+    start = time.perf_counter()
+    func()
+    elapsed = time.perf_counter() - start
+    print(f'{label:>10}: {elapsed:8.2f}s  {line_count / elapsed:12,.0f} lines/sec')
+    return elapsed
+
+
+def main() -> None:
+    ''' Run parse_logs benchmark '''
+    parser = argparse.ArgumentParser(description='Audit parse throughput benchmark')
+    parser.add_argument('--lines', type=int, default=2000000, help='log lines in the synthetic day')
+    parser.add_argument('--audit-ratio', type=float, default=0.01, help='share of lines that are audit logs')
+    parser.add_argument('--skip-legacy', action='store_true', help='only time the current implementation')
+    args = parser.parse_args()
+
+    company_map, user_company = synthetic.reference_data()
+    synthetic.StaticRefTool.configure(company_map, user_company)
+    setattr(audit_ops, 'RefTool', synthetic.StaticRefTool)
+
+    log_messages = list(synthetic.admin_log_lines(args.lines, args.audit_ratio))
+    ops = audit_ops.AuditOps(datetime(2020, 5, 11))
+    print(f'{len(log_messages):,} lines')
+
+    current = timed('registry', lambda: ops.parse_logs(log_messages), len(log_messages))
+    if not args.skip_legacy:
+        legacy = timed('legacy', lambda: legacy_parse(ops, log_messages), len(log_messages))
+        print(f'{"speedup":>10}: {legacy / current:8.1f}x')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,161 @@
+"""
+Benchmark suite for the audit trail pipeline
+
+Generates a synthetic blapi admin day with every audited action mixed into
+noise lines, packs it into gzip archives laid out like a CloudWatch export and
+runs the audit path against in-memory S3, CloudWatch Logs and customer db
+stand-ins. Reports lines/sec, time per audit parser and peak RSS per stage.
+The peak RSS is reset before each stage on Linux, so it is the stage's own
+peak; elsewhere the peak of Python allocations is traced per stage instead.
+The filter stage reads through the filter_log_events source; its stand-in
+scans the archives, so it measures client overhead, not CloudWatch.
+Run: python -m benchmarks.audit_pipeline --lines 1000000
+
+Parse workers are separate processes that can't see the in-memory stand-ins,
+so the report stage always runs with a single worker.
+"""
+import argparse
+import time
+import tracemalloc
+
+from datetime import datetime
+from typing import Callable, Dict, List, Tuple, TypeVar
+from benchmarks import stubs, synthetic
+from operators.audit_trail import audit_ops
+from operators.audit_trail.audit_parser import AuditParser, AuditRegistry, tokenize
+from utils import db
+from utils.aws import logs, s3, session
+
+report_day = datetime(2020, 5, 10)
+T = TypeVar('T')
+
+
+def reset_peak_rss() -> bool:
+    ''' Reset the peak resident set size of the process to its current size.
+    Only Linux supports this, False is returned elsewhere. '''
+    try:
+        with open('/proc/self/clear_refs', 'w') as refs:
+            refs.write('5')
+        return True
+    except OSError:
+        return False
+
+
+def peak_rss_mb() -> float:
+    ''' Peak resident set size of the process since the last reset in MB '''
+    with open('/proc/self/status') as status:
+        for line in status:
+            if line.startswith('VmHWM:'):
+                return int(line.split()[1]) / 1024
+
+    return 0.0
+
+
+def install_stand_ins(archives: Dict[str, bytes], company_map: Dict[str, str],
+                      user_company: List[dict]) -> stubs.MemoryS3Client:
+    ''' Point the s3, logs and db modules at in-memory stand-ins '''
+    s3_client = stubs.MemoryS3Client()
+    session.set_client('s3', s3_client)
+    session.set_client('logs', stubs.MemoryLogsClient(s3_client, archives))
+    customer_db = stubs.MemoryCustomerDb({
+        'audit_trail_company_map_vw': [{'id': int(k), 'name': v} for k, v in company_map.items()],
+        'audit_trail_user_company_vw': user_company
+    })
+    db.customer_pipelines = customer_db.customer_pipelines
+    audit_ops.slackapi.send_message = lambda channel, message: None
+    return s3_client
+
+
+def instrument(registry: AuditRegistry) -> Dict[str, List[float]]:
+    ''' Wrap each parser's scope_parse to collect [calls, seconds] per action '''
+    timings = {}
+    for action, parser in registry.parsers.items():
+        stats = timings[action] = [0, 0.0]
+
+        def timed(action_id: str, scope_parse: Callable = parser.scope_parse, stats: list = stats) -> list:
+            start = time.perf_counter()
+            records = scope_parse(action_id)
+            stats[0] += 1
+            stats[1] += time.perf_counter() - start
+            return records
+
+        setattr(parser, 'scope_parse', timed)
+
+    return timings
+
+
+def stage(results: List[Tuple[str, int, float, float]], label: str, line_count: int,
+          func: Callable[[], T]) -> T:
+    ''' Time a benchmark stage and record its throughput and its own peak rss, or
+    its peak traced allocations where the peak rss can't be reset '''
+    traced = not reset_peak_rss()
+    if traced:
+        tracemalloc.start()
+
+    start = time.perf_counter()
+    value = func()
+    elapsed = time.perf_counter() - start
+    if traced:
+        peak_mb = tracemalloc.get_traced_memory()[1] / 1024 / 1024
+        tracemalloc.stop()
+    else:
+        peak_mb = peak_rss_mb()
+
+    results.append((label, line_count, elapsed, peak_mb))
+    return value
+
+
+def main() -> None:
+    ''' Run the audit pipeline benchmark suite '''
+    parser = argparse.ArgumentParser(description='Audit pipeline benchmark suite')
+    parser.add_argument('--lines', type=int, default=1000000, help='log lines in the synthetic day (1M-50M)')
+    parser.add_argument('--audit-ratio', type=float, default=0.01, help='share of lines that are audit logs')
+    parser.add_argument('--streams', type=int, default=8, help='log streams in the export')
+    parser.add_argument('--lines-per-file', type=int, default=250000, help='lines per exported gz file')
+    parser.add_argument('--companies', type=int, default=5000, help='companies in the reference data')
+    parser.add_argument('--users', type=int, default=20000, help='users in the reference data')
+    args = parser.parse_args()
+
+    results: List[Tuple[str, int, float, float]] = []
+    lines = synthetic.admin_log_lines(args.lines, args.audit_ratio, args.companies, args.users, day=report_day)
+    archives = stage(results, 'generate', args.lines,
+                     lambda: synthetic.export_archives(lines, args.streams, args.lines_per_file))
+    archive_mb = sum(len(a) for a in archives.values()) / 1024 / 1024
+    print(f'{args.lines:,} lines in {len(archives)} gz files ({archive_mb:,.1f} MB)')
+
+    company_map, user_company = synthetic.reference_data(args.companies, args.users)
+    s3_client = install_stand_ins(archives, company_map, user_company)
+    ops = audit_ops.AuditOps(report_day + audit_ops.timedelta(days=1))
+
+    stage(results, 'read', args.lines, lambda: sum(1 for _ in ops.pull_admin_logs()))
+    window_start, window_end = ops.log_window
+    stage(results, 'prefilter', args.lines,
+          lambda: sum(1 for _ in logs.log_stream(logs.LogGroup.blapi_admin, window_start, window_end,
+                                                 audit_ops.audit_prefilter)))
+    stage(results, 'filter', args.lines,
+          lambda: sum(1 for _ in ops.pull_admin_logs(logs.LogSource.filter)))
+
+    audit_lines = [line for line in ops.pull_admin_logs() if AuditParser.signature in line]
+    stage(results, 'tokenize', len(audit_lines), lambda: [tokenize(line) for line in audit_lines])
+
+    ops.ref_tool.load()
+    timings = instrument(ops.registry)
+    report = stage(results, 'parse', args.lines, lambda: ops.parse_logs(ops.pull_admin_logs()))
+
+    stage(results, 'report', args.lines, lambda: audit_ops.generate_audit_report(ops.proc_dt, workers=1))
+    report_key = ops.audit_trail_key
+    report_mb = len(s3_client.bucket(s3.default_bucket)[report_key]) / 1024 / 1024
+    print(f'{len(report.splitlines()) - 1:,} report rows ({report_mb:,.1f} MB)\n')
+
+    print(f'{"stage":<10} {"lines":>12} {"seconds":>9} {"lines/sec":>13} {"peak rss MB":>12}')
+    for label, count, elapsed, rss in results:
+        print(f'{label:<10} {count:>12,} {elapsed:>9.2f} {count / elapsed:>13,.0f} {rss:>12,.1f}')
+
+    print(f'\n{"parser":<34} {"calls":>8} {"seconds":>9} {"us/call":>9}')
+    for action, (calls, seconds) in sorted(timings.items(), key=lambda t: -t[1][1]):
+        per_call = seconds / calls * 1000000 if calls else 0
+        print(f'{action:<34} {calls:>8,} {seconds:>9.3f} {per_call:>9.1f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,64 @@
+"""
+Startup benchmark for the ghp CLI
+
+Times `python ghp.py <command> --help` for every subcommand in fresh
+interpreters, which covers importing the command module and building its
+parser, and reports the slowest imports of each command from -X importtime.
+Run: python -m benchmarks.cli_startup --runs 5
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+from typing import List, Tuple
+
+repo_home = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+commands = ['configure', 'renv', 'start', 'list-envs', 'discover', 'op_runner']
+
+
+def run_command(args: List[str]) -> Tuple[float, str]:
+    ''' Wall time in seconds and stderr of a ghp command in a new interpreter '''
+    started = time.perf_counter()
+    result = subprocess.run(
+        [sys.executable, *args],
+        cwd=repo_home,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.PIPE,
+        universal_newlines=True
+    )
+    return time.perf_counter() - started, result.stderr
+
+
+def slowest_imports(importtime: str, count: int) -> List[Tuple[int, str]]:
+    ''' Modules with the largest cumulative import time (us) in -X importtime output '''
+    imports = []
+    for line in importtime.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, module = line[len('import time:'):].split('|')
+        imports.append((int(cumulative), module.strip()))
+
+    return sorted(imports, reverse=True)[:count]
+
+
+def main() -> None:
+    ''' Run the CLI startup benchmark '''
+    parser = argparse.ArgumentParser(description='ghp CLI startup benchmark')
+    parser.add_argument('--runs', type=int, default=5, help='runs per command')
+    parser.add_argument('--top', type=int, default=3, help='slowest imports listed per command')
+    args = parser.parse_args()
+
+    baseline = statistics.median(run_command(['-c', 'pass'])[0] for _ in range(args.runs))
+    print(f'{"command":<12} {"median ms":>10} {"over python ms":>15}  slowest imports (cumulative ms)')
+    for command in commands:
+        median = statistics.median(run_command(['ghp.py', command, '--help'])[0] for _ in range(args.runs))
+        _, importtime = run_command(['-X', 'importtime', 'ghp.py', command, '--help'])
+        imports = ', '.join(f'{m} {us / 1000:.0f}' for us, m in slowest_imports(importtime, args.top))
+        print(f'{command:<12} {median * 1000:>10.0f} {(median - baseline) * 1000:>15.0f}  {imports}')
+
+
+if __name__ == '__main__':
+    main()
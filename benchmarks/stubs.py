@@ -0,0 +1,205 @@
+"""
+In-memory stand-ins for the S3, CloudWatch Logs and customer db clients
+so the audit pipeline can be benchmarked offline
+"""
+import gzip
+import hashlib
+import uuid
+
+from datetime import datetime, timezone
+from io import BytesIO
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Tuple, Union
+from botocore.exceptions import ClientError
+from utils.db import RowFormat, row_maker
+
+
+class MemoryBody(BytesIO):
+    ''' Minimal botocore StreamingBody replacement '''
+
+    def iter_chunks(self, chunk_size: int = 1024) -> Iterator[bytes]:
+        ''' Yield the body in chunks '''
+        return iter(lambda: self.read(chunk_size), b'')
+
+
+class MemoryS3Client(object):
+    ''' Subset of the boto3 s3 client backed by a dict. ETags are computed like s3
+    does for unencrypted objects, the md5 of the object or of its part md5s for
+    multipart objects, whose part sizes are kept for PartNumber reads. Reads with
+    IfMatch fail when the ETag has changed. '''
+
+    def __init__(self):
+        self.objects: Dict[str, Dict[str, bytes]] = {}
+        self.uploads: Dict[str, Dict[int, bytes]] = {}
+        self.part_sizes: Dict[Tuple[str, str], List[int]] = {}
+
+    def bucket(self, name: str) -> Dict[str, bytes]:
+        ''' Objects of a bucket '''
+        return self.objects.setdefault(name, {})
+
+    def etag(self, Bucket: str, Key: str) -> str:
+        ''' Quoted ETag of an object '''
+        data = self.bucket(Bucket)[Key]
+        sizes = self.part_sizes.get((Bucket, Key))
+        if sizes is None or sum(sizes) != len(data):
+            return f'"{hashlib.md5(data).hexdigest()}"'
+
+        digests = b''.join(hashlib.md5(part).digest() for part in self.split_parts(data, sizes))
+        return f'"{hashlib.md5(digests).hexdigest()}-{len(sizes)}"'
+
+    @staticmethod
+    def split_parts(data: bytes, sizes: List[int]) -> List[bytes]:
+        ''' Parts of a multipart object '''
+        offsets = [sum(sizes[:i]) for i in range(len(sizes) + 1)]
+        return [data[start:end] for start, end in zip(offsets, offsets[1:])]
+
+    def list_objects_v2(self, Bucket: str, Prefix: str = '', ContinuationToken: Optional[str] = None,
+                        MaxKeys: int = 1000, Delimiter: Optional[str] = None, **kwargs) -> dict:
+        entries = {}
+        for k in self.bucket(Bucket):
+            if not k.startswith(Prefix):
+                continue
+            cut = k.find(Delimiter, len(Prefix)) if Delimiter else -1
+            entries[k[:cut + 1] if cut >= 0 else k] = cut >= 0
+        names = sorted(entries)
+        start = int(ContinuationToken or 0)
+        page = names[start:start + MaxKeys]
+        response = {
+            'Contents': [{'Key': k, 'Size': len(self.bucket(Bucket)[k])} for k in page if not entries[k]],
+            'CommonPrefixes': [{'Prefix': k} for k in page if entries[k]],
+            'IsTruncated': start + MaxKeys < len(names),
+            'KeyCount': len(page)
+        }
+        if response['IsTruncated']:
+            response['NextContinuationToken'] = str(start + MaxKeys)
+        for listed in ('Contents', 'CommonPrefixes'):
+            if not response[listed]:
+                del response[listed]
+        return response
+
+    def get_object(self, Bucket: str, Key: str, Range: Optional[str] = None, PartNumber: Optional[int] = None,
+                   IfMatch: Optional[str] = None, **kwargs) -> dict:
+        if Key not in self.bucket(Bucket):
+            raise ClientError({'Error': {'Code': 'NoSuchKey'}}, 'GetObject')
+        etag = self.etag(Bucket, Key)
+        if IfMatch is not None and IfMatch != etag:
+            raise ClientError({'Error': {'Code': 'PreconditionFailed'}}, 'GetObject')
+        data = self.bucket(Bucket)[Key]
+        total = len(data)
+        response: Dict[str, Any] = {'ETag': etag}
+        if PartNumber is not None:
+            sizes = self.part_sizes.get((Bucket, Key), [total])
+            if not 1 <= PartNumber <= len(sizes):
+                raise ClientError({'Error': {'Code': 'InvalidPartNumber'}}, 'GetObject')
+            data = self.split_parts(data, sizes)[PartNumber - 1]
+            response['PartsCount'] = len(sizes)
+        elif Range:
+            first, last = Range.replace('bytes=', '').split('-')
+            if first:
+                data = data[int(first):int(last) + 1 if last else None]
+            else:
+                data = data[-int(last):]
+        response.update({'Body': MemoryBody(data), 'ContentLength': len(data), 'ContentRange': f'bytes */{total}'})
+        return response
+
+    def head_object(self, Bucket: str, Key: str, **kwargs) -> dict:
+        if Key not in self.bucket(Bucket):
+            raise ClientError({'Error': {'Code': '404'}}, 'HeadObject')
+        return {'ContentLength': len(self.bucket(Bucket)[Key]), 'ETag': self.etag(Bucket, Key)}
+
+    def put_object(self, Bucket: str, Key: str, Body: bytes = b'', **kwargs) -> dict:
+        if isinstance(Body, str):
+            Body = Body.encode('utf-8')
+        elif hasattr(Body, 'read'):
+            Body = Body.read()
+        self.bucket(Bucket)[Key] = bytes(Body)
+        self.part_sizes.pop((Bucket, Key), None)
+        return {'ETag': self.etag(Bucket, Key)}
+
+    def delete_objects(self, Bucket: str, Delete: dict, **kwargs) -> dict:
+        for item in Delete['Objects']:
+            self.bucket(Bucket).pop(item['Key'], None)
+            self.part_sizes.pop((Bucket, item['Key']), None)
+        return {'Deleted': Delete['Objects']}
+
+    def create_multipart_upload(self, Bucket: str, Key: str, **kwargs) -> dict:
+        upload_id = uuid.uuid4().hex
+        self.uploads[upload_id] = {}
+        return {'UploadId': upload_id}
+
+    def upload_part(self, Body: bytes, Bucket: str, Key: str, PartNumber: int, UploadId: str, **kwargs) -> dict:
+        self.uploads[UploadId][PartNumber] = bytes(Body)
+        return {'ETag': f'"{hashlib.md5(Body).hexdigest()}"'}
+
+    def complete_multipart_upload(self, Bucket: str, Key: str, UploadId: str, MultipartUpload: dict) -> dict:
+        uploaded = self.uploads.pop(UploadId)
+        parts = [uploaded[p['PartNumber']] for p in MultipartUpload['Parts']]
+        self.bucket(Bucket)[Key] = b''.join(parts)
+        self.part_sizes[(Bucket, Key)] = [len(part) for part in parts]
+        return {'ETag': self.etag(Bucket, Key)}
+
+    def abort_multipart_upload(self, Bucket: str, Key: str, UploadId: str) -> dict:
+        self.uploads.pop(UploadId, None)
+        return {}
+
+
+class MemoryLogsClient(object):
+    ''' CloudWatch Logs client whose export tasks complete immediately by
+    copying pregenerated archives into the memory s3 client '''
+
+    def __init__(self, s3_client: MemoryS3Client, archives: Dict[str, bytes]):
+        self.s3_client = s3_client
+        self.archives = archives
+
+    def create_export_task(self, destination: str, destinationPrefix: str, **kwargs) -> dict:
+        task_id = uuid.uuid4().hex
+        bucket = self.s3_client.bucket(destination)
+        for name, data in self.archives.items():
+            bucket[f'{destinationPrefix}/{task_id}/{name}'] = data
+        return {'taskId': task_id}
+
+    def describe_export_tasks(self, taskId: str, **kwargs) -> dict:
+        return {'exportTasks': [{'taskId': taskId, 'status': {'code': 'COMPLETED'}}]}
+
+    def filter_log_events(self, startTime: int, endTime: int, filterPattern: str = '',
+                          nextToken: Optional[str] = None, limit: int = 10000, **kwargs) -> dict:
+        ''' Scan the archives for lines containing the quoted filter term, like
+        CloudWatch matching a quoted phrase pattern '''
+        term = filterPattern.strip('"').encode('utf-8')
+        events = []
+        for name, data in sorted(self.archives.items()):
+            for number, line in enumerate(gzip.decompress(data).splitlines()):
+                if term not in line:
+                    continue
+                stamp, _, message = line.decode('utf-8').partition(' ')
+                timestamp = datetime.strptime(stamp, '%Y-%m-%dT%H:%M:%S.%fZ').replace(tzinfo=timezone.utc)
+                epoch_ms = int(timestamp.timestamp() * 1000)
+                if startTime <= epoch_ms <= endTime:
+                    events.append({'timestamp': epoch_ms, 'message': message, 'eventId': f'{name}:{number}'})
+
+        start = int(nextToken or 0)
+        response: Dict[str, Any] = {'events': events[start:start + limit]}
+        if start + limit < len(events):
+            response['nextToken'] = str(start + limit)
+        return response
+
+
+class MemoryCustomerDb(object):
+    ''' Serves pipelines views from in-memory rows in db.customer_pipelines batches '''
+
+    def __init__(self, tables: Dict[str, List[dict]]):
+        self.tables = tables
+
+    def customer_pipelines(self, table: str, batch_size: int = 10000, where: Optional[str] = None,
+                           params: Sequence = (), columns: Optional[Sequence[str]] = None,
+                           row_format: Union[RowFormat, str] = RowFormat.dict) -> Iterator[list]:
+        rows = self.tables[table]
+        if where:
+            # only the "<column> IN %s" predicates of RefTool.fetch are supported
+            column = where.split()[0]
+            ids = {str(i) for i in params[0]}
+            rows = [row for row in rows if str(row[column]) in ids]
+
+        columns = columns or (tuple(rows[0]) if rows else ())
+        make_rows = row_maker(RowFormat(row_format), table, list(columns))
+        for i in range(0, len(rows), batch_size):
+            yield make_rows([tuple(row[c] for c in columns) for row in rows[i:i + batch_size]])
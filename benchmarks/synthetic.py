@@ -0,0 +1,163 @@
+"""
+Synthetic blapi admin log data for audit trail benchmarks
+"""
+import random
+
+from datetime import datetime
+from gzip import GzipFile
+from io import BytesIO
+from typing import Dict, Iterator, List, Tuple
+from operators.audit_trail.audit_parser import AuditParser, audit_specs
+from operators.audit_trail.reference import RefTool
+
+# log keys written by blapi for each audited admin action
+action_fields = {
+    spec.action: list(dict.fromkeys(f.source.key for f in spec.fields))
+    for spec in audit_specs
+}
+
+first_names = ['Jane', 'John', 'Maria', 'Wei', 'Amara', 'Luis', 'Priya', 'Tom']
+last_names = ['Smith', 'Garcia', 'Chen', 'Okafor', 'Patel', 'Nguyen', 'Kowalski']
+company_words = ['Acme', 'Harbor', 'Summit', 'Granite', 'Pioneer', 'Cedar', 'Atlas']
+company_kinds = ['Holdings LLC', 'Capital Partners', 'Logistics Inc', 'Trust Co']
+reasons = ['Missing KYC documents', 'Duplicate application', 'Failed OFAC screening, escalated']
+noise_modules = ['lib/routes/accounts.js', 'lib/routes/wires.js', 'lib/db/pool.js', 'lib/auth/session.js']
+
+
+def person(rnd: random.Random) -> str:
+    ''' Random full name '''
+    return f'{rnd.choice(first_names)} {rnd.choice(last_names)}'
+
+
+def company(rnd: random.Random) -> str:
+    ''' Random company name '''
+    return f'{rnd.choice(company_words)} {rnd.choice(company_words)} {rnd.choice(company_kinds)}'
+
+
+def reference_data(companies: int = 5000, users: int = 20000,
+                   seed: int = 0) -> Tuple[Dict[str, str], List[dict]]:
+    ''' Company map and user company rows shaped like the audit trail views '''
+    rnd = random.Random(seed)
+    company_map = {str(i): company(rnd) for i in range(1, companies + 1)}
+    user_company = []
+    for user_id in range(1, users + 1):
+        user_name = person(rnd)
+        for company_id in rnd.sample(range(1, companies + 1), rnd.randint(1, 3)):
+            user_company.append({
+                'user_id': user_id,
+                'user_name': user_name,
+                'company_id': company_id,
+                'company_name': company_map[str(company_id)]
+            })
+
+    return company_map, user_company
+
+
+def field_value(rnd: random.Random, key: str, companies: int, users: int) -> str:
+    ''' Random value for an audit log key '''
+    if key == 'companyId':
+        return str(rnd.randint(1, companies))
+    if key == 'userId':
+        return str(rnd.randint(1, users))
+    if key == 'amount':
+        return f'{rnd.randint(100, 5000000)}.{rnd.randint(0, 99):02d}'
+    if key == 't24TransactionId':
+        return f'FT{rnd.randint(10 ** 9, 10 ** 10 - 1)}'
+    if key == 'accountType':
+        return rnd.choice(['Checking', 'Money Market', 'Escrow'])
+    if key == 'wireStatus':
+        return rnd.choice(['OPEN', 'CLOSED'])
+    if key == 'rejectionReason':
+        return rnd.choice(reasons)
+    if key in ('authorizerFullname',):
+        return person(rnd)
+    return company(rnd)
+
+
+def audit_line(rnd: random.Random, timestamp: str, action: str,
+               companies: int, users: int) -> str:
+    ''' Admin log line for an audited action '''
+    fields = [f'action={action}', f'adminFullName={person(rnd)}']
+    fields += [f'{k}={field_value(rnd, k, companies, users)}' for k in action_fields[action]]
+    return f'{timestamp} info: {AuditParser.signature} {", ".join(fields)}'
+
+
+def noise_line(rnd: random.Random, timestamp: str) -> str:
+    ''' Admin log line that is not part of the audit trail '''
+    return (f'{timestamp} info: module={rnd.choice(noise_modules)} method=GET '
+            f'path=/v1/companies/{rnd.randint(1, 9999)}/accounts status=200 duration={rnd.randint(1, 900)}ms')
+
+
+def admin_log_lines(count: int, audit_ratio: float = 0.01, companies: int = 5000,
+                    users: int = 20000, seed: int = 0,
+                    day: datetime = datetime(2020, 5, 10)) -> Iterator[str]:
+    ''' Stream of synthetic admin log lines for a single day '''
+    rnd = random.Random(seed)
+    actions = list(action_fields)
+    date_str = day.strftime('%Y-%m-%d')
+    step = 86400000 / max(count, 1)
+    for i in range(count):
+        ms = int(i * step)
+        timestamp = '{}T{:02d}:{:02d}:{:02d}.{:03d}Z'.format(
+            date_str, ms // 3600000, ms // 60000 % 60, ms // 1000 % 60, ms % 1000
+        )
+        if rnd.random() < audit_ratio:
+            yield audit_line(rnd, timestamp, rnd.choice(actions), companies, users)
+        else:
+            yield noise_line(rnd, timestamp)
+
+
+def export_archives(lines: Iterator[str], streams: int = 8,
+                    lines_per_file: int = 250000) -> Dict[str, bytes]:
+    ''' Gzip log lines into files laid out like a CloudWatch export task,
+    {log stream}/{sequence}.gz relative to the task prefix. Lines are dealt
+    round robin across the log streams as the instances behind blapi would write
+    them, and compressed as they are generated so only the archives are held.
+    '''
+    buffers = [BytesIO() for _ in range(streams)]
+    files = [GzipFile(fileobj=b, mode='wb', compresslevel=6) for b in buffers]
+    counts = [0] * streams
+    sequence = [0] * streams
+    archives = {}
+
+    def close(stream: int) -> None:
+        files[stream].close()
+        archives[f'i-{stream:017x}/{sequence[stream]:06d}.gz'] = buffers[stream].getvalue()
+        buffers[stream] = BytesIO()
+        files[stream] = GzipFile(fileobj=buffers[stream], mode='wb', compresslevel=6)
+        counts[stream] = 0
+        sequence[stream] += 1
+
+    for i, line in enumerate(lines):
+        stream = i % streams
+        files[stream].write(line.encode('utf-8') + b'\n')
+        counts[stream] += 1
+        if counts[stream] >= lines_per_file:
+            close(stream)
+
+    for stream in range(streams):
+        if counts[stream]:
+            close(stream)
+
+    return archives
+
+
+class StaticRefTool(RefTool):
+    ''' RefTool backed by in-memory reference data instead of the customer db '''
+
+    shared = RefTool()
+
+    @classmethod
+    def configure(cls, company_map: Dict[str, str], user_company: List[dict]) -> None:
+        ''' Index reference data once for every StaticRefTool instance '''
+        cls.shared = RefTool()
+        cls.shared.index(
+            company_map.items(),
+            ((row['user_id'], row['user_name'], row['company_name']) for row in user_company)
+        )
+
+    def load(self) -> None:
+        ''' Share the preindexed reference data '''
+        self._company_map = self.shared._company_map
+        self._user_index = self.shared._user_index
+        self._loaded = True
@@ -0,0 +1,87 @@
+"""
+Micro-benchmark for the audit log tokenizer
+
+Compares audit_parser.tokenize against the word by word tokenizer it replaced
+on realistic blapi admin audit lines.
+Run: python -m benchmarks.tokenizer --lines 200000
+"""
+import argparse
+import timeit
+
+from typing import Dict, List
+from operators.audit_trail.audit_parser import tokenize, AuditParser, TokenKeys
+from benchmarks import synthetic
+
+
+def legacy_tokenize(log_message: str) -> Dict[str, str]:
+    ''' AuditParser.get_tokens as it was before the single split tokenizer '''
+    tokens = {}
+    i = 0
+    sections = log_message.split(' ')
+    log_len = len(sections)
+    while i < log_len:
+        if '=' in sections[i]:
+            key, val = sections[i].split('=')
+            i += 1
+            while i < log_len and '=' not in sections[i]:
+                val = f'{val} {sections[i]}'
+                i += 1
+            tokens[key] = val[:-1] if val[-1] == ',' else val
+        else:
+            i += 1
+
+    if sections:
+        tokens['timestamp'] = sections[0]
+
+    return tokens
+
+
+def audit_lines(count: int) -> List[str]:
+    ''' Audit log lines only, the lines that actually reach the tokenizer '''
+    lines = synthetic.admin_log_lines(count * 200, audit_ratio=0.005)
+    return [line for line in lines if AuditParser.signature in line][:count]
+
+
+def main() -> None:
+    ''' Run tokenizer benchmark '''
+    parser = argparse.ArgumentParser(description='Audit tokenizer micro-benchmark')
+    parser.add_argument('--lines', type=int, default=200000, help='audit lines to tokenize')
+    parser.add_argument('--repeat', type=int, default=3, help='timing repetitions, best is reported')
+    args = parser.parse_args()
+
+    lines = audit_lines(args.lines)
+    # keys as a SpecParser extracts them, checked against the legacy tokens
+    keys = TokenKeys({'timestamp', 'adminFullName', 'companyId', 'amount'})
+    mismatches = sum(1 for line in lines if tokenize(line) != legacy_tokenize(line))
+    key_mismatches = sum(
+        1 for line in lines
+        if tokenize(line, keys) != {k: v for k, v in legacy_tokenize(line).items() if k in keys}
+    )
+    print(f'{len(lines):,} audit lines, {mismatches} output mismatches, {key_mismatches} keyed mismatches')
+
+    long_value = (f'2020-05-10T12:00:00.000Z info: {AuditParser.signature} action=Reject Pending Customer, '
+                  f'adminFullName=Jane Smith, rejectionReason={" ".join(["word"] * 300)}, companyId=12')
+    long_lines = [long_value] * max(len(lines) // 100, 1)
+    cases = [
+        ('legacy', lambda: [legacy_tokenize(line) for line in lines]),
+        ('tokenize', lambda: [tokenize(line) for line in lines]),
+        ('tokenize(keys)', lambda: [tokenize(line, keys) for line in lines]),
+        ('legacy long', lambda: [legacy_tokenize(line) for line in long_lines]),
+        ('tokenize long', lambda: [tokenize(line) for line in long_lines]),
+        ('tokenize(keys) long', lambda: [tokenize(line, keys) for line in long_lines])
+    ]
+
+    results = {}
+    for label, func in cases:
+        results[label] = min(timeit.repeat(func, number=1, repeat=args.repeat))
+        count = len(long_lines) if label.endswith('long') else len(lines)
+        print(f'{label:>20}: {results[label]:7.3f}s  {count / results[label]:12,.0f} lines/sec')
+
+    print(f'{"speedup":>20}: {results["legacy"] / results["tokenize"]:7.1f}x')
+    print(f'{"speedup keys":>20}: {results["legacy"] / results["tokenize(keys)"]:7.1f}x')
+    print(f'{"speedup long":>20}: {results["legacy long"] / results["tokenize long"]:7.1f}x')
+    print(f'{"speedup keys long":>20}: {results["legacy long"] / results["tokenize(keys) long"]:7.1f}x')
+
+
+if __name__ == '__main__':
+    main()
@@ -3,18 +3,18 @@ GH-Pipelines CLI
 """
 
 import argparse
+import importlib
 import logging
 import sys
 
-from utils.arg_parser import configure, renv, start, list_envs, discover, op_runner
-
+# command modules are imported only when their command runs
 parse_options = {
-    'configure': configure,
-    'renv': renv,
-    'start': start,
-    'list-envs': list_envs,
-    'discover': discover,
-    'op_runner': op_runner
+    'configure': 'utils.arg_parser.configure',
+    'renv': 'utils.arg_parser.renv',
+    'start': 'utils.arg_parser.start',
+    'list-envs': 'utils.arg_parser.list_envs',
+    'discover': 'utils.arg_parser.discover',
+    'op_runner': 'utils.arg_parser.op_runner'
 }
 
 
@@ -52,6 +52,6 @@ if __name__ == "__main__":
 
     args = ghp_parser.parse_args()
 
-    command_parser = parse_options[args.command]
+    command_parser = importlib.import_module(parse_options[args.command])
 
     command_parser.parse(args.args)
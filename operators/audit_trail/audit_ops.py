@@ -2,22 +2,82 @@
 Module provides functions for processing admin logs
 """
 import operators.audit_trail.audit_parser as ap
+import csv
+import json
 import logging
+import multiprocessing
 import os
+import tempfile
 
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+from contextlib import ExitStack, contextmanager
+from functools import partial
+from io import StringIO
 from operators.audit_trail.reference import RefTool, AuditRecord
-from typing import Iterable, Iterator, List
+from operators.audit_trail.report import (
+    CsvReportWriter, DbReportWriter, ParquetReportWriter, ReportFormat, ReportWriter, report_header
+)
+from typing import IO, Callable, Deque, Dict, Iterable, Iterator, List, NamedTuple, Optional, Sequence, Set, Tuple
 from utils.aws import logs, s3
-from utils import slackapi
+from utils import db, slackapi
 from datetime import datetime, timedelta
 
 
+# only raw log lines with the audit signature are decoded and parsed
+audit_prefilter = ap.AuditParser.signature.encode('utf-8')
+# incremental updates stop this far behind utc now so logs still being
+# ingested by CloudWatch are picked up by a later run (see source_lag)
+incremental_lag = timedelta(hours=1)
+
+
+def source_lag(source: logs.LogSource, lag: timedelta = incremental_lag) -> timedelta:
+    ''' How far behind utc now logs are read from the source. Exports only hold
+    the logs CloudWatch made available for export, so they lag by at least the
+    export lag; filtered logs are searchable soon after they are written. '''
+    if source == logs.LogSource.export:
+        return max(lag, logs.export_lag)
+
+    return lag
+
+
+class Checkpoint(NamedTuple):
+    ''' Progress of an incrementally built audit report '''
+
+    last_timestamp: datetime
+    last_action_id: int
+
+
+class AuditLogSpool(object):
+    ''' Collected audit logs spooled to a temporary file as json lines, so they wait
+    on disk while reference data is fetched, and read back in the order added '''
+
+    def __init__(self):
+        self.file = tempfile.TemporaryFile('w+')
+
+    def add(self, audit_log: ap.AuditLog) -> None:
+        ''' Spool an audit log with its tokens '''
+        self.file.write(json.dumps(audit_log) + '\n')
+
+    def audit_logs(self) -> Iterator[ap.AuditLog]:
+        ''' The spooled audit logs in the order they were added '''
+        self.file.seek(0)
+        for line in self.file:
+            yield ap.AuditLog._make(json.loads(line))
+
+    def close(self) -> None:
+        ''' Delete the spool file '''
+        self.file.close()
+
+
 class AuditOps(object):
     ''' Tool to handle audit report generation operations '''
 
     def __init__(self, proc_dt: datetime):
         self.proc_dt = proc_dt
         self.s3_audit_trail_path = 'audit-trail'
+        self.ref_tool = RefTool()
+        self._registry: Optional[ap.AuditRegistry] = None
 
     @property
     def audit_report_channel(self) -> str:
@@ -45,31 +105,49 @@ class AuditOps(object):
         ''' S3 key for audit report document '''
         return f'{self.s3_audit_trail_path}/{self.date_str}/{self.date_str}_Admin_Panel_Audit_Report.csv'
 
+    @property
+    def parquet_partition(self) -> str:
+        ''' S3 prefix of the report date's parquet partition '''
+        return f'{self.s3_audit_trail_path}/parquet/report_date={self.date_str}'
+
+    @property
+    def parquet_partition_uri(self) -> str:
+        ''' S3 uri of the report date's parquet partition '''
+        return f's3://{s3.default_bucket}/{self.parquet_partition}/'
+
+    def parquet_key(self, first_action_id: int = 1) -> str:
+        ''' S3 key for the parquet part holding actions from first_action_id '''
+        return f'{self.parquet_partition}/part-{first_action_id:08d}.parquet'
+
+    @property
+    def checkpoint_key(self) -> str:
+        ''' S3 key for the audit report checkpoint '''
+        return f'{self.s3_audit_trail_path}/{self.date_str}/{self.date_str}_checkpoint.json'
+
     @property
     def auditors(self) -> List[ap.AuditParser]:
         ''' List of Audit parsers used for the audit report '''
-        ref_tool = RefTool()
-        return [
-            ap.ApprovePendingCustomer(),
-            ap.RejectPendingCustomer(ref_tool),
-            ap.ApprovePendingAccount(ref_tool),
-            ap.RejectPendingAccount(ref_tool),
-            ap.ApprovePendingAuthorizer(ref_tool),
-            ap.RejectPendingAuthorizer(ref_tool),
-            ap.ResetCustomerPassword(ref_tool),
-            ap.ApproveOFACFlaggedTransaction(),
-            ap.RejectOFACFlaggedTransaction(ref_tool),
-            ap.ApproveHybridTransaction(),
-            ap.RejectHybridTransaction(ref_tool),
-            ap.ChangeWireWindow(),
-            ap.DeactivateUser(ref_tool),
-            ap.AddNewEntity()
-        ]
-
-    def pull_admin_logs(self) -> Iterator[str]:
-        ''' Get stream of admin logs for a 24 hour period ending at the proc_dt '''
-        start = datetime(self.proc_dt.year, self.proc_dt.month, self.proc_dt.day) - timedelta(days=1)
+        return ap.compile_parsers(self.ref_tool)
+
+    @property
+    def registry(self) -> ap.AuditRegistry:
+        ''' Audit parser registry, built once and shared by every log message '''
+        if self._registry is None:
+            self._registry = ap.AuditRegistry(self.auditors)
+
+        return self._registry
+
+    @property
+    def log_window(self) -> Tuple[datetime, datetime]:
+        ''' Start and end of the 24 hour period ending at the proc_dt '''
         end = datetime(self.proc_dt.year, self.proc_dt.month, self.proc_dt.day)
+        return end - timedelta(days=1), end
+
+    def pull_admin_logs(self, source: logs.LogSource = logs.LogSource.export) -> Iterator[str]:
+        ''' Get stream of admin logs for a 24 hour period ending at the proc_dt '''
+        start, end = self.log_window
+        if source == logs.LogSource.filter:
+            return self.filter_admin_logs(start, end)
 
         admin_logs = logs.log_stream(
             logs.LogGroup.blapi_admin,
@@ -79,46 +157,409 @@ class AuditOps(object):
 
         return admin_logs
 
-    def parse_logs(self, log_messages: Iterable[str]) -> str:
-        ''' Parse log messages and return csv of extracted data '''
-        audit_record_csv = [','.join(f.upper() for f in AuditRecord._fields)]
+    def filter_admin_logs(self, start: datetime, end: datetime) -> Iterator[str]:
+        ''' Get only the audit log lines of the admin logs, filtered by CloudWatch '''
+        return logs.filtered_log_stream(
+            logs.LogGroup.blapi_admin,
+            start,
+            end,
+            filter_pattern=f'"{ap.AuditParser.signature}"'
+        )
+
+    def export_admin_logs(self, start: Optional[datetime] = None,
+                          end: Optional[datetime] = None) -> List[dict]:
+        ''' Export admin logs and get the s3 listing of the gz files, by default
+        for the 24 hour period ending at the proc_dt '''
+        window_start, window_end = self.log_window
+        return list(logs.export_archives(logs.LogGroup.blapi_admin, start or window_start, end or window_end))
+
+    def load_checkpoint(self) -> Optional[Checkpoint]:
+        ''' Get the report checkpoint if the report has been started '''
+        stream = s3.get_object(self.checkpoint_key)
+        if not stream:
+            return None
+
+        details = json.loads(stream.read())
+        return Checkpoint(
+            last_timestamp=datetime.fromisoformat(details['last_timestamp']),
+            last_action_id=details['last_action_id']
+        )
+
+    def save_checkpoint(self, checkpoint: Checkpoint) -> None:
+        ''' Store the report checkpoint '''
+        details = {
+            'last_timestamp': checkpoint.last_timestamp.isoformat(),
+            'last_action_id': checkpoint.last_action_id
+        }
+        s3.upload_object(self.checkpoint_key, json.dumps(details))
 
-        action_id = 1
+    def audit_actions(self, log_messages: Iterable[str], first_action_id: int = 1) -> Iterator[List[AuditRecord]]:
+        ''' Audit records grouped by the admin action they were logged for,
+        with action ids numbered from first_action_id in log order '''
+        registry = self.registry
+        action_id = first_action_id
         for log in log_messages:
-            is_audit_record = False
-            for adt in self.auditors:
-                adt.log_message = log
-                audit_details = adt.extract_audit_details(str(action_id))
-                if audit_details:
-                    is_audit_record = True
-                    break
-
-            if is_audit_record:
+            audit_details = registry.extract_audit_details(log, str(action_id))
+            if audit_details:
                 action_id += 1
-                audit_record_csv += [','.join(detail) for detail in audit_details]
+                yield audit_details
 
-        return '\n'.join(audit_record_csv)
+    def collect_audit_logs(self, log_messages: Iterable[str]) -> Iterator[ap.AuditLog]:
+        ''' Audit logs among the log messages, each matched and tokenized once '''
+        registry = self.registry
+        for log in log_messages:
+            audit_log = registry.audit_log(log)
+            if audit_log is not None:
+                yield audit_log
 
+    def parse_audit_logs(self, audit_logs: Iterable[ap.AuditLog],
+                         first_action_id: int = 1) -> Iterator[List[AuditRecord]]:
+        ''' Audit records of collected audit logs grouped by action, with action ids
+        numbered from first_action_id in log order '''
+        registry = self.registry
+        action_id = first_action_id
+        for audit_log in audit_logs:
+            audit_details = registry.parse(audit_log, str(action_id))
+            if audit_details:
+                action_id += 1
+                yield audit_details
 
-def generate_audit_report(proc_dt: datetime = datetime.now()):
-    ''' Generate audit report and store it in s3 '''
-    audit_ops = AuditOps(proc_dt)
+    def spool_audit_logs(self, audit_logs: Iterable[ap.AuditLog],
+                         spool_for: Callable[[ap.AuditLog], Optional[AuditLogSpool]]) -> None:
+        ''' Spool each audit log to the spool chosen for it, dropping logs without one,
+        and fetch reference data for the company and user ids the spooled logs need
+        once they have all been seen '''
+        registry = self.registry
+        company_ids: Set[str] = set()
+        user_ids: Set[str] = set()
+        for audit_log in audit_logs:
+            spool = spool_for(audit_log)
+            if spool is not None:
+                spool.add(audit_log)
+                companies, users = registry.reference_ids(audit_log)
+                company_ids.update(companies)
+                user_ids.update(users)
 
-    logging.info(f'Pull admin logs for report date: {audit_ops.date_str}')
-    admin_logs = audit_ops.pull_admin_logs()
+        self.ref_tool.fetch(company_ids, user_ids)
+
+    def targeted_audit_actions(self, audit_logs: Iterable[ap.AuditLog],
+                               first_action_id: int = 1) -> Iterator[List[AuditRecord]]:
+        ''' Audit actions parsed in two phases: the collected audit logs are spooled to
+        disk while the company and user ids they reference are gathered, then reference
+        data is fetched for just those ids before the spooled logs are parsed '''
+        spool = AuditLogSpool()
+        try:
+            self.spool_audit_logs(audit_logs, lambda audit_log: spool)
+            yield from self.parse_audit_logs(spool.audit_logs(), first_action_id)
+        finally:
+            spool.close()
+
+    def parallel_audit_logs(self, archive_keys: List[str], workers: int,
+                            window: Optional[Tuple[datetime, datetime]] = None) -> Iterator[ap.AuditLog]:
+        ''' Audit logs of exported gz files, read, matched and tokenized across worker
+        processes and merged in file order. At most two files per worker are queued so
+        the collected logs waiting to be merged stay bounded. Parsing them from their
+        tokens is left to the caller, once reference data has been fetched. '''
+        collect_pool = ProcessPoolExecutor(
+            max_workers=workers,
+            mp_context=multiprocessing.get_context('spawn'),
+            initializer=init_archive_worker,
+            initargs=(self.proc_dt,)
+        )
 
-    logging.info('Parse admin log messages')
-    audit_report_csv = audit_ops.parse_logs(admin_logs)
+        with collect_pool:
+            pending: Deque[Future] = deque()
+            for key in archive_keys:
+                pending.append(collect_pool.submit(collect_archive, key, window))
+                if len(pending) >= workers * 2:
+                    yield from pending.popleft().result()
+
+            while pending:
+                yield from pending.popleft().result()
+
+    def report_csv(self, actions: Iterable[List[AuditRecord]]) -> str:
+        ''' Csv of the audit records for each action '''
+        buffer = StringIO()
+        writer = csv.writer(buffer, lineterminator='\n')
+        writer.writerow(report_header())
+        for audit_details in actions:
+            writer.writerows(audit_details)
+
+        return buffer.getvalue()
+
+    def parse_logs(self, log_messages: Iterable[str]) -> str:
+        ''' Parse log messages and return csv of extracted data '''
+        return self.report_csv(self.audit_actions(log_messages))
 
-    logging.info('Upload report to s3')
-    s3.upload_object(
-        key=audit_ops.audit_trail_key,
-        data=audit_report_csv,
-        public=True
+
+worker_ops: Optional[AuditOps] = None
+
+
+def init_archive_worker(proc_dt: datetime) -> None:
+    ''' Set up the audit ops for a collect worker process '''
+    global worker_ops
+    worker_ops = AuditOps(proc_dt)
+
+
+def archive_worker() -> AuditOps:
+    ''' Audit ops of a collect worker process '''
+    if worker_ops is None:
+        raise RuntimeError('Archive collection must run in a worker set up by init_archive_worker')
+
+    return worker_ops
+
+
+def collect_archive(gzfile: str, window: Optional[Tuple[datetime, datetime]] = None) -> List[ap.AuditLog]:
+    ''' Audit logs of a single exported gz file, limited to the window if given.
+    Runs in a worker process. '''
+    start, end = window or (None, None)
+    return list(archive_worker().collect_audit_logs(logs.read_archive(gzfile, start, end, audit_prefilter)))
+
+
+def archive_audit_logs(audit_ops: AuditOps, archives: List[dict], workers: int,
+                       window: Optional[Tuple[datetime, datetime]] = None) -> Iterator[ap.AuditLog]:
+    ''' Audit logs collected from the s3 listing of exported log files. The files are
+    read across worker processes when there is more than one worker and file,
+    otherwise through the prefetcher so the next files download while one is read.
+    Exports may be reused from a wider range, so lines are limited to the window
+    when one is given. '''
+    if workers > 1 and len(archives) > 1:
+        logging.info(f'Collect admin log messages from {len(archives)} files with {workers} workers')
+        return audit_ops.parallel_audit_logs([a['Key'] for a in archives], workers, window)
+
+    logging.info('Collect admin log messages')
+    start, end = window or (None, None)
+    bodies = logs.prefetch_archives(archives)
+    return audit_ops.collect_audit_logs(
+        log for body in bodies for log in logs.archive_lines(body, start, end, audit_prefilter)
     )
 
+
+def parse_archives(audit_ops: AuditOps, archives: List[dict], workers: int, first_action_id: int = 1,
+                   window: Optional[Tuple[datetime, datetime]] = None) -> Iterator[List[AuditRecord]]:
+    ''' Audit actions from the s3 listing of exported log files, parsed once reference
+    data has been fetched for the collected audit logs '''
+    return audit_ops.targeted_audit_actions(archive_audit_logs(audit_ops, archives, workers, window), first_action_id)
+
+
+def admin_audit_logs(audit_ops: AuditOps, start: datetime, end: datetime, workers: int,
+                     source: logs.LogSource = logs.LogSource.export) -> Iterator[ap.AuditLog]:
+    ''' Audit logs from the admin logs between start and end, read from an s3 export
+    (kept for reuse until the archive retention passes) or straight from CloudWatch
+    with a filter pattern '''
+    if source == logs.LogSource.filter:
+        logging.info('Collect filtered admin log messages')
+        return audit_ops.collect_audit_logs(audit_ops.filter_admin_logs(start, end))
+
+    archives = audit_ops.export_admin_logs(start, end)
+    return archive_audit_logs(audit_ops, archives, workers, (start, end))
+
+
+@contextmanager
+def admin_actions(audit_ops: AuditOps, start: datetime, end: datetime, workers: int,
+                  first_action_id: int = 1,
+                  source: logs.LogSource = logs.LogSource.export) -> Iterator[Iterator[List[AuditRecord]]]:
+    ''' Audit actions from the admin logs between start and end (see admin_audit_logs) '''
+    audit_logs = admin_audit_logs(audit_ops, start, end, workers, source)
+    yield audit_ops.targeted_audit_actions(audit_logs, first_action_id)
+
+
+def create_report_tables(formats: Sequence[ReportFormat]) -> None:
+    ''' Create the tables reports in the formats are loaded into, once before any
+    report is written '''
+    if ReportFormat.db in formats:
+        DbReportWriter.create_table()
+
+
+def write_report(audit_ops: AuditOps, actions: Iterable[List[AuditRecord]],
+                 first_action_id: int = 1, append: bool = False,
+                 formats: Sequence[ReportFormat] = (ReportFormat.csv,)) -> int:
+    ''' Write audit actions to the audit report in s3 and/or the customer db and return
+    the last action id. With append the new rows are added after the rows of the
+    existing report, parquet reports get a new part in the report date's partition
+    and db reports keep the date's loaded rows. Rows from first_action_id on that
+    a failed append left behind are replaced, so an append can be rerun from its
+    checkpoint. The db table must exist (see create_report_tables). '''
+    last_action_id = first_action_id - 1
+
+    logging.info(f'Write {audit_ops.date_str} report as {", ".join(f.value for f in formats)}')
+    with ExitStack() as stack:
+        writers: List[ReportWriter] = []
+        if ReportFormat.csv in formats:
+            existing: Optional[IO[bytes]] = None
+            if append and s3.exists(audit_ops.audit_trail_key):
+                # the download is verified and pinned to the report's ETag, so a report
+                # rewritten meanwhile fails the append instead of being copied half old
+                existing = stack.enter_context(tempfile.TemporaryFile())
+                s3.download_to(audit_ops.audit_trail_key, existing)
+                existing.seek(0)
+            csv_writer = CsvReportWriter(audit_ops.audit_trail_key, public=True, header=existing is None)
+            writers.append(stack.enter_context(csv_writer))
+            if existing is not None:
+                csv_writer.copy_from(iter(partial(existing.read, s3.default_part_size), b''), first_action_id)
+
+        if ReportFormat.parquet in formats:
+            if not append:
+                s3.delete_objects([r['Key'] for r in s3.search(audit_ops.parquet_partition + '/')])
+            parquet_writer = ParquetReportWriter(audit_ops.parquet_key(first_action_id))
+            writers.append(stack.enter_context(parquet_writer))
+
+        if ReportFormat.db in formats:
+            writers.append(stack.enter_context(DbReportWriter(audit_ops.date_str, first_action_id)))
+
+        for audit_details in actions:
+            for writer in writers:
+                writer.write(audit_details)
+            last_action_id += 1
+
+    return last_action_id
+
+
+def post_report_link(audit_ops: AuditOps, formats: Sequence[ReportFormat] = (ReportFormat.csv,)) -> None:
+    ''' Post the link of the report written in the formats to slack: the csv report
+    when there is one, otherwise the parquet partition. Reports only loaded into
+    the db have no link to post. '''
+    if ReportFormat.csv in formats:
+        link = audit_ops.audit_report_url
+    elif ReportFormat.parquet in formats:
+        link = audit_ops.parquet_partition_uri
+    else:
+        logging.info(f'No report link to post for {audit_ops.date_str}')
+        return
+
     logging.info(f'Post link to {audit_ops.audit_report_channel} channel')
     slackapi.send_message(
         channel=audit_ops.audit_report_channel,
-        message=audit_ops.audit_report_url
+        message=link
     )
+
+
+def generate_audit_report(proc_dt: datetime = datetime.now(), workers: Optional[int] = None,
+                          formats: Sequence[ReportFormat] = (ReportFormat.csv,),
+                          source: logs.LogSource = logs.LogSource.export):
+    ''' Generate audit report and store it in s3 as csv and/or parquet and/or load it
+    into the customer db.
+    Exported log files are parsed across worker processes (one per cpu by default),
+    workers=1 parses them serially. The filter source skips the export and reads
+    only audit lines from CloudWatch. '''
+    audit_ops = AuditOps(proc_dt)
+    workers = workers or os.cpu_count() or 1
+    start, end = audit_ops.log_window
+    create_report_tables(formats)
+
+    logging.info(f'Pull admin logs for report date: {audit_ops.date_str}')
+    with admin_actions(audit_ops, start, end, workers, source=source) as actions:
+        last_action_id = write_report(audit_ops, actions, formats=formats)
+
+    audit_ops.save_checkpoint(Checkpoint(end, last_action_id))
+    post_report_link(audit_ops, formats)
+
+
+def update_audit_reports(as_of: Optional[datetime] = None, workers: Optional[int] = None,
+                         formats: Sequence[ReportFormat] = (ReportFormat.csv,),
+                         source: logs.LogSource = logs.LogSource.export,
+                         lag: timedelta = incremental_lag):
+    ''' Bring audit reports up to date with the admin logs written since their checkpoints.
+    Only the logs after each checkpoint are exported and parsed, and their rows are
+    appended to the report. The previous day is finished off first, and the report
+    link is posted once a day's report is complete. as_of is a utc time and reports
+    are only updated up to lag before it (at least the export lag for the export
+    source), leaving time for late logs to arrive. '''
+    cutoff = (as_of or datetime.utcnow()) - source_lag(source, lag)
+    workers = workers or os.cpu_count() or 1
+    create_report_tables(formats)
+
+    for proc_dt in (cutoff, cutoff + timedelta(days=1)):
+        audit_ops = AuditOps(proc_dt)
+        start, end = audit_ops.log_window
+        checkpoint = audit_ops.load_checkpoint()
+        append = checkpoint is not None
+        checkpoint = checkpoint or Checkpoint(start, 0)
+        window_end = min(end, cutoff)
+        if checkpoint.last_timestamp >= window_end:
+            continue
+
+        logging.info(f'Pull admin logs for report date {audit_ops.date_str} '
+                     f'from {checkpoint.last_timestamp} to {window_end}')
+        first_action_id = checkpoint.last_action_id + 1
+        with admin_actions(audit_ops, checkpoint.last_timestamp, window_end,
+                           workers, first_action_id, source) as actions:
+            last_action_id = write_report(
+                audit_ops,
+                actions,
+                first_action_id=first_action_id,
+                append=append,
+                formats=formats
+            )
+
+        audit_ops.save_checkpoint(Checkpoint(window_end, last_action_id))
+        if window_end == end:
+            post_report_link(audit_ops, formats)
+
+
+def backfill_audit_reports(start: datetime, end: datetime, workers: Optional[int] = None,
+                           formats: Sequence[ReportFormat] = (ReportFormat.csv,),
+                           source: logs.LogSource = logs.LogSource.export):
+    ''' Generate audit reports for every report date from start to end (inclusive),
+    which must be a complete day (source_lag past its end) in utc.
+    The whole range is exported at once and its audit logs are spooled to disk
+    per report date by log timestamp, with their tokens, while the ids they
+    reference are gathered. Reference data is then fetched once for those ids,
+    and the daily reports are parsed from their spools and written concurrently,
+    so only the reference data and the logs of the files being read are held in
+    memory. '''
+    first_date = datetime(start.year, start.month, start.day)
+    last_date = datetime(end.year, end.month, end.day)
+    complete_end = datetime.utcnow() - source_lag(source)
+    if last_date < first_date:
+        raise ValueError(f'Backfill end {last_date:%Y-%m-%d} is before its start {first_date:%Y-%m-%d}')
+    if last_date + timedelta(days=1) > complete_end:
+        raise ValueError(f'Backfill end {last_date:%Y-%m-%d} is not a complete day yet, '
+                         f'the latest is {complete_end - timedelta(days=1):%Y-%m-%d}')
+
+    workers = workers or os.cpu_count() or 1
+    day_count = (last_date - first_date).days + 1
+    ref_tool = RefTool()
+    create_report_tables(formats)
+
+    day_ops = {}
+    for i in range(day_count):
+        audit_ops = AuditOps(first_date + timedelta(days=i + 1))
+        audit_ops.ref_tool = ref_tool
+        day_ops[audit_ops.date_str] = audit_ops
+
+    range_ops = AuditOps(first_date + timedelta(days=day_count))
+    range_ops.ref_tool = ref_tool
+
+    logging.info(f'Pull admin logs for report dates {first_date:%Y-%m-%d} to {range_ops.date_str}')
+    range_end = first_date + timedelta(days=day_count)
+
+    with ExitStack() as stack:
+        day_spools: Dict[str, AuditLogSpool] = {}
+        for date_str in day_ops:
+            day_spools[date_str] = AuditLogSpool()
+            stack.callback(day_spools[date_str].close)
+
+        range_ops.spool_audit_logs(
+            admin_audit_logs(range_ops, first_date, range_end, workers, source),
+            lambda audit_log: day_spools.get(audit_log.tokens.get('timestamp', '')[:10])
+        )
+
+        # each day parses with its own registry, reports share the db connection pool
+        with ThreadPoolExecutor(max_workers=min(day_count, db.max_pool_connections)) as pool:
+            futures = {
+                date_str: pool.submit(
+                    write_report,
+                    day_ops[date_str],
+                    day_ops[date_str].parse_audit_logs(spool.audit_logs()),
+                    formats=formats
+                )
+                for date_str, spool in day_spools.items()
+            }
+
+            for date_str, future in futures.items():
+                last_action_id = future.result()
+                audit_ops = day_ops[date_str]
+                _, day_end = audit_ops.log_window
+                audit_ops.save_checkpoint(Checkpoint(day_end, last_action_id))
+                logging.info(f'Wrote {last_action_id} actions to {audit_ops.audit_trail_key}')
@@ -1,529 +1,340 @@
 """
 Log parsers for audit trail data
 """
-from typing import Dict, List
-from operators.audit_trail.reference import AuditRecord, Section, PageTitle, RefTool, Label
-
-
-class AuditParser(object):
-    ''' Base class for extracting audit logs data from blapi admin logs '''
-
-    action = ''
-    signature = 'module=lib/auditLog.js'
-
-    def __init__(self):
-        self.log_message = ''
-
-    def get_tokens(self) -> Dict[str, str]:
-        ''' Extract key value pairs from the log message '''
-        tokens = {}
-        i = 0
-        sections = self.log_message.split(' ')
-        log_len = len(sections)
-        while i < log_len:
-            if '=' in sections[i]:
-                key, val = sections[i].split('=')
-                i += 1
-                while i < log_len and '=' not in sections[i]:
-                    val = f'{val} {sections[i]}'
-                    i += 1
-                tokens[key] = val[:-1] if val[-1] == ',' else val
-            else:
-                i += 1
-
-        if sections:
-            tokens['timestamp'] = sections[0]
-
-        return tokens
-
-    def scope_parse(self, action_id: str) -> List[AuditRecord]:
-        ''' Parse logs for specific audit log scenario '''
-        return []
-
-    def extract_audit_details(self, action_id: str = '-1') -> List[AuditRecord]:
-        ''' Get data relavent for the specific audit report type from log mesasge'''
-        is_audit_log = self.signature in self.log_message
-        has_action = self.action in self.log_message
-        return self.scope_parse(action_id) if is_audit_log and has_action else []
-
-
-class ApprovePendingCustomer(AuditParser):
-    ''' Parser for "Approve Pending Customer" logs '''
-
-    action = 'Approve Pending Customer'
-
-    def scope_parse(self, action_id: str) -> List[AuditRecord]:
-        ''' Parse log message for "approve pending customer" scenario '''
-        tk = self.get_tokens()
-        records = []
-        records.append(AuditRecord(
-            action_id=action_id,
-            timestamp=tk.get('timestamp', ''),
-            user=tk.get('adminFullName', ''),
-            action=self.action,
-            section=Section.customer.value,
-            title=PageTitle.customer.value,
-            label=Label.company_name.value,
-            value=tk.get('customerName', '')
-        ))
-        return records
+import re
 
+from typing import Callable, Collection, Dict, Iterable, Iterator, List, NamedTuple, Optional, Tuple, Union
+from operators.audit_trail.reference import AuditRecord, Section, PageTitle, RefTool, Label
 
-class RejectPendingCustomer(AuditParser):
-    ''' Parser for "Reject Pending Customer" logs '''
-
-    action = 'Reject Pending Customer'
-
-    def __init__(self, ref_tool: RefTool):
-        super().__init__()
-        self.ref_tool = ref_tool
-
-    def scope_parse(self, action_id: str) -> List[AuditRecord]:
-        ''' Parse log message for "reject pending customer" scenario '''
-        tk = self.get_tokens()
-        records = []
-        records.append(AuditRecord(
-            action_id=action_id,
-            timestamp=tk.get('timestamp', ''),
-            user=tk.get('adminFullName', ''),
-            action=self.action,
-            section=Section.customer.value,
-            title=PageTitle.customer.value,
-            label=Label.company_name.value,
-            value=self.ref_tool.company_map.get(tk.get('companyId', ''), '')
-        ))
-        records.append(AuditRecord(
-            action_id=action_id,
-            timestamp=tk.get('timestamp', ''),
-            user=tk.get('adminFullName', ''),
-            action=self.action,
-            section=Section.customer.value,
-            title=PageTitle.customer.value,
-            label=Label.reject_reason.value,
-            value=tk.get('rejectionReason', '')
-        ))
-        return records
-
-
-class ApprovePendingAccount(AuditParser):
-    ''' Parser for "Approve Pending Account" logs '''
-
-    action = 'Approve Pending Account'
-
-    def __init__(self, ref_tool: RefTool):
-        super().__init__()
-        self.ref_tool = ref_tool
-
-    def scope_parse(self, action_id: str) -> List[AuditRecord]:
-        ''' Parse log message for "approve pending account" scenario '''
-        tk = self.get_tokens()
-        records = []
-        records.append(AuditRecord(
-            action_id=action_id,
-            timestamp=tk.get('timestamp', ''),
-            user=tk.get('adminFullName', ''),
-            action=self.action,
-            section=Section.customer.value,
-            title=PageTitle.account.value,
-            label=Label.company_name.value,
-            value=self.ref_tool.company_map.get(tk.get('companyId', ''), '')
-        ))
-        records.append(AuditRecord(
-            action_id=action_id,
-            timestamp=tk.get('timestamp', ''),
-            user=tk.get('adminFullName', ''),
-            action=self.action,
-            section=Section.customer.value,
-            title=PageTitle.account.value,
-            label=Label.account_type.value,
-            value=tk.get('accountType', '')
-        ))
-
-        return records
+class TokenKeys(object):
+    ''' Keys for tokenize to extract, with the " key=" strings each is found by '''
 
+    def __init__(self, keys: Iterable[str]):
+        self.keys = frozenset(keys)
+        self.needles = tuple((k, f' {k}=') for k in self.keys if k != 'timestamp')
+        self.timestamp = 'timestamp' in self.keys
 
-class RejectPendingAccount(AuditParser):
-    ''' Parser for "Reject Pending Account" logs '''
+    def __contains__(self, key: object) -> bool:
+        return key in self.keys
 
-    action = 'Reject Pending Account'
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.keys)
 
-    def __init__(self, ref_tool: RefTool):
-        super().__init__()
-        self.ref_tool = ref_tool
+    def __len__(self) -> int:
+        return len(self.keys)
 
-    def scope_parse(self, action_id: str) -> List[AuditRecord]:
-        ''' Parse log message for "reject pending account" scenario '''
-        tk = self.get_tokens()
-        records = []
-        records.append(AuditRecord(
-            action_id=action_id,
-            timestamp=tk.get('timestamp', ''),
-            user=tk.get('adminFullName', ''),
-            action=self.action,
-            section=Section.customer.value,
-            title=PageTitle.account.value,
-            label=Label.company_name.value,
-            value=self.ref_tool.company_map.get(tk.get('companyId', ''), '')
-        ))
-
-        return records
 
+def strip_comma(value: str) -> str:
+    ''' Token value without its single trailing comma '''
+    return value[:-1] if value[-1:] == ',' else value
 
-class ApprovePendingAuthorizer(AuditParser):
-    ''' Parser for "Approve Pending Authorizer" logs '''
 
-    action = 'Approve Pending Authorizer'
+def value_end(log_message: str, start: int) -> int:
+    ''' End of the token value starting at start: the space in front of the next
+    word containing "=", or the end of the message '''
+    eq = log_message.find('=', start)
+    while eq != -1:
+        space = log_message.rfind(' ', start, eq)
+        if space != -1:
+            return space
+        # the "=" is inside the value's first word
+        eq = log_message.find('=', eq + 1)
 
-    def __init__(self, ref_tool: RefTool):
-        super().__init__()
-        self.ref_tool = ref_tool
+    return len(log_message)
 
-    def scope_parse(self, action_id: str) -> List[AuditRecord]:
-        ''' Parse log message for "approve pending authorizer" scenario '''
-        tk = self.get_tokens()
-        records = []
-        records.append(AuditRecord(
-            action_id=action_id,
-            timestamp=tk.get('timestamp', ''),
-            user=tk.get('adminFullName', ''),
-            action=self.action,
-            section=Section.user.value,
-            title=PageTitle.authorizer.value,
-            label=Label.authorizer.value,
-            value=tk.get('authorizerFullname', '')
-        ))
-        records.append(AuditRecord(
-            action_id=action_id,
-            timestamp=tk.get('timestamp', ''),
-            user=tk.get('adminFullName', ''),
-            action=self.action,
-            section=Section.user.value,
-            title=PageTitle.authorizer.value,
-            label=Label.company_name.value,
-            value=self.ref_tool.company_map.get(tk.get('companyId', ''), '')
-        ))
 
-        return records
+def find_tokens(log_message: str, keys: TokenKeys) -> Dict[str, str]:
+    ''' Extract only the given keys, each found with a single reverse search for
+    " key=" so the rest of the message is never split '''
+    tokens = {}
+    for key, needle in keys.needles:
+        start = log_message.rfind(needle)
+        if start != -1:
+            start += len(needle)
+            tokens[key] = strip_comma(log_message[start:value_end(log_message, start)])
 
+    if keys.timestamp:
+        tokens['timestamp'] = log_message.partition(' ')[0]
 
-class RejectPendingAuthorizer(AuditParser):
-    ''' Parser for "Reject Pending Authorizer" logs '''
+    return tokens
 
-    action = 'Reject Pending Authorizer'
 
-    def __init__(self, ref_tool: RefTool):
-        super().__init__()
-        self.ref_tool = ref_tool
+def tokenize(log_message: str, keys: Optional[Collection[str]] = None) -> Dict[str, str]:
+    ''' Extract key value pairs from a log message.
+    The first word of the message is stored as the timestamp token and a single
+    trailing comma is stripped from each value. When keys is given only those
+    tokens are extracted (pass a TokenKeys built once to skip rebuilding it).
+    Otherwise the message is split once on "=": every piece but the last ends
+    with the next key, so the pieces are cut at their last space.
+    '''
+    if keys is not None:
+        return find_tokens(log_message, keys if isinstance(keys, TokenKeys) else TokenKeys(keys))
 
-    def scope_parse(self, action_id: str) -> List[AuditRecord]:
-        ''' Parse log message for "reject pending authorizer" scenario '''
-        tk = self.get_tokens()
-        records = []
-        records.append(AuditRecord(
-            action_id=action_id,
-            timestamp=tk.get('timestamp', ''),
-            user=tk.get('adminFullName', ''),
-            action=self.action,
-            section=Section.user.value,
-            title=PageTitle.authorizer.value,
-            label=Label.authorizer.value,
-            value=tk.get('authorizerFullname', '')
-        ))
-        records.append(AuditRecord(
-            action_id=action_id,
-            timestamp=tk.get('timestamp', ''),
-            user=tk.get('adminFullName', ''),
-            action=self.action,
-            section=Section.user.value,
-            title=PageTitle.authorizer.value,
-            label=Label.company_name.value,
-            value=self.ref_tool.company_map.get(tk.get('companyId', ''), '')
-        ))
+    head, *pieces = log_message.split('=')
+    tokens = {}
+    if pieces:
+        key = head.rpartition(' ')[2]
+        prefix = ''
+        for piece in pieces[:-1]:
+            value, space, next_key = piece.rpartition(' ')
+            if not space:
+                # an "=" inside a value word, the value carries on in the next piece
+                prefix += piece + '='
+                continue
 
-        return records
+            tokens[key] = strip_comma(prefix + value)
+            key, prefix = next_key, ''
 
+        tokens[key] = strip_comma(prefix + pieces[-1])
 
-class ResetCustomerPassword(AuditParser):
-    ''' Parser for "Reset Customer Password" logs '''
+    tokens['timestamp'] = log_message.partition(' ')[0]
+    return tokens
 
-    action = 'Reset Customer Password'
 
-    def __init__(self, ref_tool: RefTool):
-        super().__init__()
-        self.ref_tool = ref_tool
+class AuditLog(NamedTuple):
+    ''' Audit log message matched to its action, with the tokens its parser uses '''
 
-    def scope_parse(self, action_id: str) -> List[AuditRecord]:
-        ''' Parse log message for "reset customer password" scenario '''
-        tk = self.get_tokens()
-        records = []
-        user_name, companies = self.ref_tool.get_user_details(tk.get('userId', ''))
-        records.append(AuditRecord(
-            action_id=action_id,
-            timestamp=tk.get('timestamp', ''),
-            user=tk.get('adminFullName', ''),
-            action=self.action,
-            section=Section.user.value,
-            title=PageTitle.management.value,
-            label=Label.user_name.value,
-            value=user_name
-        ))
-
-        for company in companies:
-            records.append(AuditRecord(
-                action_id=action_id,
-                timestamp=tk.get('timestamp', ''),
-                user=tk.get('adminFullName', ''),
-                action=self.action,
-                section=Section.user.value,
-                title=PageTitle.authorizer.value,
-                label=Label.company_name.value,
-                value=company
-            ))
+    action: str
+    tokens: Dict[str, str]
 
-        return records
 
+class AuditParser(object):
+    ''' Base class for extracting audit logs data from blapi admin logs '''
 
-class ApproveOFACFlaggedTransaction(AuditParser):
-    ''' Parser for "Approve OFAC Flagged Transaction" logs '''
+    action = ''
+    signature = 'module=lib/auditLog.js'
+    token_keys: Optional[Collection[str]] = None
+    company_keys: Tuple[str, ...] = ()
+    user_keys: Tuple[str, ...] = ()
 
-    action = 'Approve OFAC Flagged Transaction'
+    def __init__(self):
+        self._log_message = ''
+        self._tokens: Optional[Dict[str, str]] = None
 
-    def scope_parse(self, action_id: str) -> List[AuditRecord]:
-        ''' Parse log message for "approve ofac flagged" scenario '''
-        tk = self.get_tokens()
-        records = []
-        records.append(AuditRecord(
-            action_id=action_id,
-            timestamp=tk.get('timestamp', ''),
-            user=tk.get('adminFullName', ''),
-            action=self.action,
-            section=Section.transactions.value,
-            title=PageTitle.wire.value,
-            label=Label.txn_amount.value,
-            value=tk.get('amount', '')
-        ))
-        records.append(AuditRecord(
-            action_id=action_id,
-            timestamp=tk.get('timestamp', ''),
-            user=tk.get('adminFullName', ''),
-            action=self.action,
-            section=Section.transactions.value,
-            title=PageTitle.wire.value,
-            label=Label.company_name.value,
-            value=tk.get('companyName', '')
-        ))
+    @property
+    def log_message(self) -> str:
+        ''' Log message being parsed '''
+        return self._log_message
 
-        return records
+    @log_message.setter
+    def log_message(self, log_message: str) -> None:
+        self._log_message = log_message
+        self._tokens = None
 
+    def use_tokens(self, tokens: Dict[str, str]) -> None:
+        ''' Parse tokens already taken from a log message by get_tokens '''
+        self._log_message = ''
+        self._tokens = tokens
 
-class RejectOFACFlaggedTransaction(AuditParser):
-    ''' Parser for "Rejet OFAC Flagged Transaction" logs '''
+    def get_tokens(self) -> Dict[str, str]:
+        ''' Extract the key value pairs used by the parser from the log message,
+        tokenizing each message only once '''
+        if self._tokens is None:
+            self._tokens = tokenize(self._log_message, self.token_keys)
 
-    action = 'Reject OFAC Flagged Transaction'
+        return self._tokens
 
-    def __init__(self, ref_tool: RefTool):
-        super().__init__()
-        self.ref_tool = ref_tool
+    def reference_ids(self) -> Tuple[List[str], List[str]]:
+        ''' Company and user ids in the log message that need reference data '''
+        if not self.company_keys and not self.user_keys:
+            return [], []
 
-    def scope_parse(self, action_id: str) -> List[AuditRecord]:
-        ''' Parse log message for "reject ofac flagged" scenario '''
         tk = self.get_tokens()
-        records = []
-        records.append(AuditRecord(
-            action_id=action_id,
-            timestamp=tk.get('timestamp', ''),
-            user=tk.get('adminFullName', ''),
-            action=self.action,
-            section=Section.transactions.value,
-            title=PageTitle.wire.value,
-            label=Label.txn_amount.value,
-            value=tk.get('amount', '')
-        ))
-        records.append(AuditRecord(
-            action_id=action_id,
-            timestamp=tk.get('timestamp', ''),
-            user=tk.get('adminFullName', ''),
-            action=self.action,
-            section=Section.transactions.value,
-            title=PageTitle.wire.value,
-            label=Label.company_name.value,
-            value=self.ref_tool.company_map.get(tk.get('companyId', ''), '')
-        ))
-
-        return records
-
-
-class ApproveHybridTransaction(AuditParser):
-    ''' Parser for "Approve Hybrid Transaction" logs '''
-
-    action = 'Approve Hybrid Transaction'
+        return [tk.get(k, '') for k in self.company_keys], [tk.get(k, '') for k in self.user_keys]
 
     def scope_parse(self, action_id: str) -> List[AuditRecord]:
-        ''' Parse log message for "approve hybrid transaction" scenario '''
-        tk = self.get_tokens()
-        records = []
-        records.append(AuditRecord(
-            action_id=action_id,
-            timestamp=tk.get('timestamp', ''),
-            user=tk.get('adminFullName', ''),
-            action=self.action,
-            section=Section.transactions.value,
-            title=PageTitle.hybrid.value,
-            label=Label.txn_amount.value,
-            value=tk.get('amount', '')
-        ))
-        records.append(AuditRecord(
-            action_id=action_id,
-            timestamp=tk.get('timestamp', ''),
-            user=tk.get('adminFullName', ''),
-            action=self.action,
-            section=Section.transactions.value,
-            title=PageTitle.hybrid.value,
-            label=Label.t24_txn_id.value,
-            value=tk.get('t24TransactionId', '')
-        ))
-        records.append(AuditRecord(
-            action_id=action_id,
-            timestamp=tk.get('timestamp', ''),
-            user=tk.get('adminFullName', ''),
-            action=self.action,
-            section=Section.transactions.value,
-            title=PageTitle.hybrid.value,
-            label=Label.company_name.value,
-            value=tk.get('companyName', '')
-        ))
-
-        return records
-
-
-class RejectHybridTransaction(AuditParser):
-    ''' Parser for "Reject Hybrid Transaction" logs '''
-
-    action = 'Reject Hybrid Transaction'
-
-    def __init__(self, ref_tool: RefTool):
-        super().__init__()
-        self.ref_tool = ref_tool
+        ''' Parse logs for specific audit log scenario '''
+        return []
 
-    def scope_parse(self, action_id: str) -> List[AuditRecord]:
-        ''' Parse log message for "reject hybrid transaction" scenario '''
-        tk = self.get_tokens()
-        records = []
-        records.append(AuditRecord(
-            action_id=action_id,
-            timestamp=tk.get('timestamp', ''),
-            user=tk.get('adminFullName', ''),
-            action=self.action,
-            section=Section.transactions.value,
-            title=PageTitle.hybrid.value,
-            label=Label.txn_amount.value,
-            value=tk.get('amount', '')
-        ))
-        records.append(AuditRecord(
-            action_id=action_id,
-            timestamp=tk.get('timestamp', ''),
-            user=tk.get('adminFullName', ''),
-            action=self.action,
-            section=Section.transactions.value,
-            title=PageTitle.hybrid.value,
-            label=Label.company_name.value,
-            value=self.ref_tool.company_map.get(tk.get('companyId', ''), '')
-        ))
+    def extract_audit_details(self, action_id: str = '-1') -> List[AuditRecord]:
+        ''' Get data relavent for the specific audit report type from log mesasge'''
+        is_audit_log = self.signature in self.log_message
+        has_action = self.action in self.log_message
+        return self.scope_parse(action_id) if is_audit_log and has_action else []
 
-        return records
 
+class AuditRegistry(object):
+    ''' Dispatches log messages to the audit parser that handles their action.
+    The registry is built once per run and matches every action with a single
+    precompiled pattern instead of trying each parser in turn.
+    '''
 
-class ChangeWireWindow(AuditParser):
-    ''' Parser for "Change Wire Window" logs '''
+    def __init__(self, parsers: List[AuditParser]):
+        self.parsers = {p.action: p for p in parsers}
+        # longest actions first so an action that prefixes another can't shadow it
+        actions = sorted(self.parsers, key=len, reverse=True)
+        self.matcher = re.compile('|'.join(re.escape(a) for a in actions))
 
-    action = 'Change Wire Window'
+    def match(self, log_message: str) -> Optional[AuditParser]:
+        ''' Get the parser for the log message's action if it is an audit log '''
+        if AuditParser.signature not in log_message:
+            return None
 
-    def scope_parse(self, action_id: str) -> List[AuditRecord]:
-        ''' Parse log message for "change wire window" scenario '''
-        tk = self.get_tokens()
-        records = []
-        records.append(AuditRecord(
-            action_id=action_id,
-            timestamp=tk.get('timestamp', ''),
-            user=tk.get('adminFullName', ''),
-            action=self.action,
-            section=Section.wire_window.value,
-            title=PageTitle.window.value,
-            label=Label.wire_status.value,
-            value=tk.get('wireStatus', '')
-        ))
+        found = self.matcher.search(log_message)
+        return self.parsers[found.group()] if found else None
 
-        return records
+    def extract_audit_details(self, log_message: str, action_id: str = '-1') -> List[AuditRecord]:
+        ''' Get audit records for the log message or an empty list for non audit logs '''
+        parser = self.match(log_message)
+        if parser is None:
+            return []
 
+        parser.log_message = log_message
+        return parser.scope_parse(action_id)
 
-class DeactivateUser(AuditParser):
-    ''' Parser for "Deactivate User" logs '''
+    def audit_log(self, log_message: str) -> Optional[AuditLog]:
+        ''' Match and tokenize the log message once, or get None for non audit logs '''
+        parser = self.match(log_message)
+        if parser is None:
+            return None
 
-    action = 'Deactivate User'
+        parser.log_message = log_message
+        return AuditLog(parser.action, parser.get_tokens())
 
-    def __init__(self, ref_tool: RefTool):
+    def parse(self, audit_log: AuditLog, action_id: str = '-1') -> List[AuditRecord]:
+        ''' Get audit records for an audit log from its tokens '''
+        parser = self.parsers[audit_log.action]
+        parser.use_tokens(audit_log.tokens)
+        return parser.scope_parse(action_id)
+
+    def reference_ids(self, audit_log: AuditLog) -> Tuple[List[str], List[str]]:
+        ''' Company and user ids that an audit log needs reference data for '''
+        parser = self.parsers[audit_log.action]
+        parser.use_tokens(audit_log.tokens)
+        return parser.reference_ids()
+
+
+class Token(NamedTuple):
+    ''' Field value taken from a log token '''
+
+    key: str
+
+
+class CompanyRef(NamedTuple):
+    ''' Field value is the name of the company whose id is in a log token '''
+
+    key: str
+
+
+class UserName(NamedTuple):
+    ''' Field value is the name of the user whose id is in a log token '''
+
+    key: str
+
+
+class UserCompanies(NamedTuple):
+    ''' One field value per company of the user whose id is in a log token '''
+
+    key: str
+
+
+class Field(NamedTuple):
+    ''' Report row produced for an action, title defaults to the action's title '''
+
+    label: Label
+    source: Union[Token, CompanyRef, UserName, UserCompanies]
+    title: Optional[PageTitle] = None
+
+
+class ActionSpec(NamedTuple):
+    ''' Declares the report rows extracted for an admin action '''
+
+    action: str
+    section: Section
+    title: PageTitle
+    fields: List[Field]
+
+
+audit_specs = [
+    ActionSpec('Approve Pending Customer', Section.customer, PageTitle.customer, [
+        Field(Label.company_name, Token('customerName'))]),
+    ActionSpec('Reject Pending Customer', Section.customer, PageTitle.customer, [
+        Field(Label.company_name, CompanyRef('companyId')), Field(Label.reject_reason, Token('rejectionReason'))]),
+    ActionSpec('Approve Pending Account', Section.customer, PageTitle.account, [
+        Field(Label.company_name, CompanyRef('companyId')), Field(Label.account_type, Token('accountType'))]),
+    ActionSpec('Reject Pending Account', Section.customer, PageTitle.account, [
+        Field(Label.company_name, CompanyRef('companyId'))]),
+    ActionSpec('Approve Pending Authorizer', Section.user, PageTitle.authorizer, [
+        Field(Label.authorizer, Token('authorizerFullname')), Field(Label.company_name, CompanyRef('companyId'))]),
+    ActionSpec('Reject Pending Authorizer', Section.user, PageTitle.authorizer, [
+        Field(Label.authorizer, Token('authorizerFullname')), Field(Label.company_name, CompanyRef('companyId'))]),
+    ActionSpec('Reset Customer Password', Section.user, PageTitle.management, [
+        Field(Label.user_name, UserName('userId')),
+        Field(Label.company_name, UserCompanies('userId'), PageTitle.authorizer)]),
+    ActionSpec('Approve OFAC Flagged Transaction', Section.transactions, PageTitle.wire, [
+        Field(Label.txn_amount, Token('amount')), Field(Label.company_name, Token('companyName'))]),
+    ActionSpec('Reject OFAC Flagged Transaction', Section.transactions, PageTitle.wire, [
+        Field(Label.txn_amount, Token('amount')), Field(Label.company_name, CompanyRef('companyId'))]),
+    ActionSpec('Approve Hybrid Transaction', Section.transactions, PageTitle.hybrid, [
+        Field(Label.txn_amount, Token('amount')), Field(Label.t24_txn_id, Token('t24TransactionId')),
+        Field(Label.company_name, Token('companyName'))]),
+    ActionSpec('Reject Hybrid Transaction', Section.transactions, PageTitle.hybrid, [
+        Field(Label.txn_amount, Token('amount')), Field(Label.company_name, CompanyRef('companyId'))]),
+    ActionSpec('Change Wire Window', Section.wire_window, PageTitle.window, [
+        Field(Label.wire_status, Token('wireStatus'))]),
+    ActionSpec('Deactivate User', Section.user, PageTitle.management, [
+        Field(Label.user_name, UserName('userId')), Field(Label.company_name, UserCompanies('userId'))]),
+    ActionSpec('Add new entity to firm', Section.customer, PageTitle.entity, [
+        Field(Label.company_name, Token('companyName')), Field(Label.firm_name, Token('firmName'))])
+]
+
+FieldExtractor = Callable[[str, str, str, Dict[str, str]], List[AuditRecord]]
+
+
+def compile_field(spec: ActionSpec, field: Field, ref_tool: RefTool) -> FieldExtractor:
+    ''' Build a function that extracts the report rows for a field.
+    The constant columns are resolved once here so extraction only looks up the
+    field's token and builds the records. '''
+    action = spec.action
+    section = spec.section.value
+    title = (field.title or spec.title).value
+    label = field.label.value
+    key = field.source.key
+
+    if isinstance(field.source, Token):
+        def extract(action_id: str, timestamp: str, user: str, tk: Dict[str, str]) -> List[AuditRecord]:
+            return [AuditRecord(action_id, timestamp, user, action, section, title, label, tk.get(key, ''))]
+    elif isinstance(field.source, CompanyRef):
+        def extract(action_id: str, timestamp: str, user: str, tk: Dict[str, str]) -> List[AuditRecord]:
+            value = ref_tool.company_map.get(tk.get(key, ''), '')
+            return [AuditRecord(action_id, timestamp, user, action, section, title, label, value)]
+    elif isinstance(field.source, UserName):
+        def extract(action_id: str, timestamp: str, user: str, tk: Dict[str, str]) -> List[AuditRecord]:
+            value, _ = ref_tool.get_user_details(tk.get(key, ''))
+            return [AuditRecord(action_id, timestamp, user, action, section, title, label, value)]
+    else:
+        def extract(action_id: str, timestamp: str, user: str, tk: Dict[str, str]) -> List[AuditRecord]:
+            _, companies = ref_tool.get_user_details(tk.get(key, ''))
+            return [AuditRecord(action_id, timestamp, user, action, section, title, label, c) for c in companies]
+
+    return extract
+
+
+class SpecParser(AuditParser):
+    ''' Audit parser compiled from an action spec '''
+
+    def __init__(self, spec: ActionSpec, ref_tool: RefTool):
         super().__init__()
-        self.ref_tool = ref_tool
+        self.action = spec.action
+        self.token_keys = TokenKeys({'timestamp', 'adminFullName'} | {f.source.key for f in spec.fields})
+        self.company_keys = tuple({f.source.key: None for f in spec.fields if isinstance(f.source, CompanyRef)})
+        self.user_keys = tuple({
+            f.source.key: None for f in spec.fields if isinstance(f.source, (UserName, UserCompanies))
+        })
+        self.extractors = [compile_field(spec, f, ref_tool) for f in spec.fields]
 
     def scope_parse(self, action_id: str) -> List[AuditRecord]:
-        ''' Parse log message for "deactivate user" scenario '''
+        ''' Parse log message with the action's field extractors '''
         tk = self.get_tokens()
+        timestamp = tk.get('timestamp', '')
+        user = tk.get('adminFullName', '')
         records = []
-        user_name, companies = self.ref_tool.get_user_details(tk.get('userId', ''))
-        records.append(AuditRecord(
-            action_id=action_id,
-            timestamp=tk.get('timestamp', ''),
-            user=tk.get('adminFullName', ''),
-            action=self.action,
-            section=Section.user.value,
-            title=PageTitle.management.value,
-            label=Label.user_name.value,
-            value=user_name
-        ))
-
-        for company in companies:
-            records.append(AuditRecord(
-                action_id=action_id,
-                timestamp=tk.get('timestamp', ''),
-                user=tk.get('adminFullName', ''),
-                action=self.action,
-                section=Section.user.value,
-                title=PageTitle.management.value,
-                label=Label.company_name.value,
-                value=company
-            ))
+        for extract in self.extractors:
+            records += extract(action_id, timestamp, user, tk)
 
         return records
 
 
-class AddNewEntity(AuditParser):
-    ''' Parser for "Add new Entity to firm" logs '''
-
-    action = 'Add new entity to firm'
-
-    def scope_parse(self, action_id: str) -> List[AuditRecord]:
-        ''' Parse log message for "deactivate user" scenario '''
-        tk = self.get_tokens()
-        records = []
-        records.append(AuditRecord(
-            action_id=action_id,
-            timestamp=tk.get('timestamp', ''),
-            user=tk.get('adminFullName', ''),
-            action=self.action,
-            section=Section.customer.value,
-            title=PageTitle.entity.value,
-            label=Label.company_name.value,
-            value=tk.get('companyName', '')
-        ))
-        records.append(AuditRecord(
-            action_id=action_id,
-            timestamp=tk.get('timestamp', ''),
-            user=tk.get('adminFullName', ''),
-            action=self.action,
-            section=Section.customer.value,
-            title=PageTitle.entity.value,
-            label=Label.firm_name.value,
-            value=tk.get('firmName', '')
-        ))
-
-        return records
+def compile_parsers(ref_tool: RefTool, specs: List[ActionSpec] = audit_specs) -> List[AuditParser]:
+    ''' Audit parsers for each action spec '''
+    return [SpecParser(spec, ref_tool) for spec in specs]
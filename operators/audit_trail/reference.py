@@ -1,13 +1,19 @@
 """
 Reference data for audit trail process
 """
+import sys
 
-
-from typing import NamedTuple, Dict, Tuple
+from typing import Collection, NamedTuple, Dict, List, Optional, Set, Tuple, Iterable
 from enum import Enum
 from utils import db
 
 
+# ids per query when fetching reference rows for specific ids
+ref_batch_size = 1000
+company_columns = ('id', 'name')
+user_company_columns = ('user_id', 'user_name', 'company_name')
+
+
 class AuditRecord(NamedTuple):
     ''' Represents audit report row '''
 
@@ -61,25 +67,107 @@ class RefTool(object):
     ''' Tool for pulling reference data for audit trail report '''
 
     def __init__(self):
-        self._company_map = {}
-        self._user_company = []
+        self._company_map: Dict[str, str] = {}
+        self._user_index: Dict[str, Tuple[str, Tuple[str, ...]]] = {}
+        self._loaded = False
+        self._targeted = False
+        self._fetched_companies: Set[str] = set()
+        self._fetched_users: Set[str] = set()
+
+    def load(self) -> None:
+        ''' Pull company and user reference data from the pipelines views '''
+        company_batches = self.company_rows()
+        user_batches = self.user_company_rows()
+        self.index(
+            (row for batch in company_batches for row in batch),
+            (row for batch in user_batches for row in batch)
+        )
+
+    def fetch(self, company_ids: Collection[str], user_ids: Collection[str],
+              batch_size: int = ref_batch_size) -> None:
+        ''' Pull reference rows for just the given company and user ids, in batched
+        queries, and add them to the lookups. Ids already fetched are skipped so the
+        lookups can be filled in as new ids are seen. '''
+        if self._loaded:
+            return
+
+        # ids are integers in the views, a logged value like userId=undefined would
+        # fail the cast and can't match a row anyway
+        company_ids = sorted({i for i in company_ids if i.isdigit()} - self._fetched_companies)
+        user_ids = sorted({i for i in user_ids if i.isdigit()} - self._fetched_users)
+
+        # psycopg2 adapts a tuple to an IN list of literals that postgres casts to the
+        # column's type, a list would be sent as text[] and fail to compare to int ids
+        for i in range(0, len(company_ids), batch_size):
+            batches = self.company_rows('id IN %s', (tuple(company_ids[i:i + batch_size]),))
+            self._company_map.update(self.company_entries(row for batch in batches for row in batch))
+
+        for i in range(0, len(user_ids), batch_size):
+            batches = self.user_company_rows('user_id IN %s', (tuple(user_ids[i:i + batch_size]),))
+            self._user_index.update(self.user_entries(row for batch in batches for row in batch))
+
+        self._fetched_companies.update(company_ids)
+        self._fetched_users.update(user_ids)
+        self._targeted = True
+
+    @staticmethod
+    def company_rows(where: Optional[str] = None, params: tuple = ()) -> Iterable[List[tuple]]:
+        ''' Batches of (id, name) rows from the company map view '''
+        return db.customer_pipelines('audit_trail_company_map_vw', where=where, params=params,
+                                     columns=company_columns, row_format=db.RowFormat.tuple)
+
+    @staticmethod
+    def user_company_rows(where: Optional[str] = None, params: tuple = ()) -> Iterable[List[tuple]]:
+        ''' Batches of (user_id, user_name, company_name) rows from the user company view '''
+        return db.customer_pipelines('audit_trail_user_company_vw', where=where, params=params,
+                                     columns=user_company_columns, row_format=db.RowFormat.tuple)
+
+    @staticmethod
+    def company_entries(company_rows: Iterable[tuple]) -> Dict[str, str]:
+        ''' Company id to interned company name lookup entries '''
+        return {str(company_id): sys.intern(name) for company_id, name in company_rows}
+
+    @staticmethod
+    def user_entries(user_company_rows: Iterable[tuple]) -> Dict[str, Tuple[str, Tuple[str, ...]]]:
+        ''' User id to (user_name, companies) lookup entries with interned company
+        names so repeated companies share a single string '''
+        user_index: Dict[str, Tuple[str, List[str]]] = {}
+        for user_id, user_name, company_name in user_company_rows:
+            user_id = str(user_id)
+            if user_id not in user_index:
+                user_index[user_id] = (user_name, [])
+            user_index[user_id][1].append(sys.intern(company_name))
+
+        return {k: (name, tuple(companies)) for k, (name, companies) in user_index.items()}
+
+    def index(self, company_rows: Iterable[tuple], user_company_rows: Iterable[tuple]) -> None:
+        ''' Build the company and user lookups from all reference view rows '''
+        self._company_map = self.company_entries(company_rows)
+        self._user_index = self.user_entries(user_company_rows)
+        self._loaded = True
+
+    @property
+    def targeted(self) -> bool:
+        ''' True once reference rows have been pulled for specific ids instead of loaded '''
+        return self._targeted
+
+    @property
+    def loaded(self) -> bool:
+        ''' True once the reference data has been indexed '''
+        return self._loaded
 
     @property
     def company_map(self) -> Dict[str, str]:
-        ''' Mapping of company id to company name '''
-        if not self._company_map:
-            company_batches = db.customer_pipelines('audit_trail_company_map_vw')
-            self._company_map = {str(row['id']): row['name'] for batch in company_batches for row in batch}
+        ''' Mapping of company id to company name, limited to the fetched ids
+        when rows were pulled for specific ids '''
+        if not self._loaded and not self._targeted:
+            self.load()
 
         return self._company_map
 
-    def get_user_details(self, user_id: str) -> Tuple[str, list]:
-        ''' Provides user details for user id '''
-        if not self._user_company:
-            user_details = db.customer_pipelines('audit_trail_user_company_vw')
-            self._user_company = [row for batch in user_details for row in batch]
-
-        companies = [uc['company_name'] for uc in self._user_company if str(uc['user_id']) == user_id]
-        user_name = next((u['user_name'] for u in self._user_company if str(u['user_id']) == user_id), '')
+    def get_user_details(self, user_id: str) -> Tuple[str, Tuple[str, ...]]:
+        ''' Provides user name and company names for user id '''
+        if not self._loaded and not self._targeted:
+            self.load()
 
-        return user_name, companies
+        return self._user_index.get(user_id, ('', ()))
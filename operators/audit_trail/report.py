@@ -0,0 +1,262 @@
+"""
+Writers for audit trail report output
+"""
+import codecs
+import csv
+import tempfile
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from enum import Enum
+from datetime import datetime
+from io import StringIO
+from types import TracebackType
+from typing import Iterable, Iterator, List, Optional, Protocol
+from operators.audit_trail.reference import AuditRecord
+from utils import db
+from utils.aws import s3
+
+
+class ReportFormat(Enum):
+    ''' Output formats for the audit report '''
+
+    csv = 'csv'
+    parquet = 'parquet'
+    db = 'db'
+
+
+def report_header() -> list:
+    ''' Column names of the audit report '''
+    return [f.upper() for f in AuditRecord._fields]
+
+
+class ReportWriter(Protocol):
+    ''' Audit report output that write_report feeds with each action's records '''
+
+    def write(self, records: Iterable[AuditRecord]) -> None:
+        ...
+
+
+def csv_lines(chunks: Iterable[bytes]) -> Iterator[str]:
+    ''' Lines of utf-8 csv content read in byte chunks, line endings included so
+    csv.reader can rejoin quoted values that span lines '''
+    decoder = codecs.getincrementaldecoder('utf-8')()
+    tail = ''
+    for chunk in chunks:
+        lines = (tail + decoder.decode(chunk)).split('\n')
+        tail = lines.pop()
+        for line in lines:
+            yield line + '\n'
+
+    tail += decoder.decode(b'', final=True)
+    if tail:
+        yield tail
+
+
+class CsvReportWriter(object):
+    ''' Streams audit records to an s3 object as quoted csv.
+    Rows are encoded into a small text buffer and handed to a multipart upload
+    whenever the buffer fills, so memory stays flat however many rows a day has.
+    '''
+
+    def __init__(self, key: str, public: bool = False, part_size: int = s3.default_part_size,
+                 flush_size: int = 1024 * 1024, header: bool = True):
+        self.upload = s3.MultipartUpload(key, public=public, part_size=part_size, workers=s3.transfer_workers)
+        self.flush_size = flush_size
+        self.buffer = StringIO()
+        self.writer = csv.writer(self.buffer, lineterminator='\n')
+        if header:
+            self.writer.writerow(report_header())
+        self.row_count = 0
+
+    def copy_from(self, chunks: Iterable[bytes], before_action_id: Optional[int] = None) -> None:
+        ''' Copy existing report content, header included, ahead of new rows. With
+        before_action_id only the rows of earlier actions are copied, so rows left
+        by an append that failed before its checkpoint are not repeated. '''
+        self.flush()
+        if before_action_id is None:
+            for chunk in chunks:
+                self.upload.write(chunk)
+            return
+
+        rows = csv.reader(csv_lines(chunks))
+        header = next(rows, None)
+        if header:
+            self.writer.writerow(header)
+
+        for row in rows:
+            if int(row[0]) >= before_action_id:
+                break
+
+            self.writer.writerow(row)
+            if self.buffer.tell() >= self.flush_size:
+                self.flush()
+
+        self.flush()
+
+    def write(self, records: Iterable[AuditRecord]) -> None:
+        ''' Add audit records to the report '''
+        for record in records:
+            self.writer.writerow(record)
+            self.row_count += 1
+
+        if self.buffer.tell() >= self.flush_size:
+            self.flush()
+
+    def flush(self) -> None:
+        ''' Send buffered rows to the upload '''
+        self.upload.write(self.buffer.getvalue().encode('utf-8'))
+        self.buffer.seek(0)
+        self.buffer.truncate()
+
+    def close(self) -> None:
+        ''' Flush remaining rows and complete the s3 object '''
+        self.flush()
+        self.upload.close()
+
+    def abort(self) -> None:
+        ''' Discard the report '''
+        self.upload.abort()
+
+    def __enter__(self) -> 'CsvReportWriter':
+        return self
+
+    def __exit__(self, exc_type: Optional[type], exc: Optional[BaseException],
+                 tb: Optional[TracebackType]) -> None:
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+
+def parse_timestamp(timestamp: str) -> Optional[datetime]:
+    ''' Log timestamp as a datetime, None if it is not an iso timestamp '''
+    try:
+        return datetime.fromisoformat(timestamp.replace('Z', '+00:00'))
+    except ValueError:
+        return None
+
+
+class ParquetReportWriter(object):
+    ''' Writes audit records to an s3 parquet object.
+    The repeated section/title/label/action strings are dictionary encoded and the
+    timestamp is stored as a typed column. Row groups are spooled to a temporary
+    file and the file is streamed to s3 when the writer is closed.
+    '''
+
+    schema = pa.schema([
+        ('action_id', pa.int64()),
+        ('timestamp', pa.timestamp('ms', tz='UTC')),
+        ('user', pa.string()),
+        ('action', pa.dictionary(pa.int32(), pa.string())),
+        ('section', pa.dictionary(pa.int32(), pa.string())),
+        ('title', pa.dictionary(pa.int32(), pa.string())),
+        ('label', pa.dictionary(pa.int32(), pa.string())),
+        ('value', pa.string())
+    ])
+
+    def __init__(self, key: str, public: bool = False, row_group_size: int = 100000):
+        self.key = key
+        self.public = public
+        self.row_group_size = row_group_size
+        self.file = tempfile.TemporaryFile()
+        self.writer = pq.ParquetWriter(self.file, self.schema)
+        self.rows: List[AuditRecord] = []
+        self.row_count = 0
+
+    def write(self, records: Iterable[AuditRecord]) -> None:
+        ''' Add audit records to the report '''
+        self.rows.extend(records)
+        if len(self.rows) >= self.row_group_size:
+            self.flush()
+
+    def flush(self) -> None:
+        ''' Write buffered rows as a row group '''
+        if not self.rows:
+            return
+
+        action_id, timestamp, user, action, section, title, label, value = zip(*self.rows)
+        table = pa.Table.from_arrays([
+            pa.array([int(a) for a in action_id], pa.int64()),
+            pa.array([parse_timestamp(t) for t in timestamp], pa.timestamp('ms', tz='UTC')),
+            pa.array(user, pa.string()),
+            pa.array(action, pa.string()).dictionary_encode(),
+            pa.array(section, pa.string()).dictionary_encode(),
+            pa.array(title, pa.string()).dictionary_encode(),
+            pa.array(label, pa.string()).dictionary_encode(),
+            pa.array(value, pa.string())
+        ], schema=self.schema)
+        self.writer.write_table(table)
+        self.row_count += len(self.rows)
+        self.rows = []
+
+    def close(self) -> None:
+        ''' Finish the parquet file and upload it to s3 '''
+        self.flush()
+        self.writer.close()
+        self.file.seek(0)
+        s3.upload_from(self.key, self.file, public=self.public)
+        self.file.close()
+
+    def abort(self) -> None:
+        ''' Discard the report '''
+        self.writer.close()
+        self.file.close()
+
+    def __enter__(self) -> 'ParquetReportWriter':
+        return self
+
+    def __exit__(self, exc_type: Optional[type], exc: Optional[BaseException],
+                 tb: Optional[TracebackType]) -> None:
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+
+class DbReportWriter(object):
+    ''' Bulk loads audit records into the audit report table of the customer db.
+    Rows carry their report date, and the rows already loaded for the date from
+    first_action_id on are replaced, so rerunning a day or an append does not
+    duplicate rows. The table is created with create_table beforehand.
+    '''
+
+    table = 'audit_trail_report'
+    columns = list(AuditRecord._fields) + ['report_date']
+    column_types = ['bigint', 'timestamptz', 'text', 'text', 'text', 'text', 'text', 'text', 'date']
+
+    def __init__(self, report_date: str, first_action_id: int = 1):
+        self.report_date = report_date
+        self.loader = db.CopyLoader(
+            self.table,
+            self.columns,
+            replace_where='report_date = %s AND action_id >= %s',
+            replace_params=(report_date, first_action_id)
+        )
+
+    @classmethod
+    def create_table(cls) -> None:
+        ''' Create the audit report table if it doesn't exist '''
+        db.create_table(cls.table, cls.columns, cls.column_types)
+
+    def write(self, records: Iterable[AuditRecord]) -> None:
+        ''' Add audit records to the report '''
+        self.loader.write(record + (self.report_date,) for record in records)
+
+    def close(self) -> None:
+        ''' Load the remaining records and commit the report '''
+        self.loader.close()
+
+    def abort(self) -> None:
+        ''' Discard the report '''
+        self.loader.abort()
+
+    def __enter__(self) -> 'DbReportWriter':
+        return self
+
+    def __exit__(self, exc_type: Optional[type], exc: Optional[BaseException],
+                 tb: Optional[TracebackType]) -> None:
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
@@ -9,6 +9,8 @@ class OpCommand(Enum):
     ''' Operator commands '''
 
     audit_report = 1
+    audit_report_update = 2
+    audit_backfill = 3
 
 
 class Trigger(object):
@@ -34,3 +36,8 @@ class Trigger(object):
     def audit_report(self) -> str:
         ''' Run audit report generation '''
         return self.get_bash_command(VenvTag.operators, OpCommand.audit_report)
+
+    @property
+    def audit_report_update(self) -> str:
+        ''' Append logs since the last checkpoint to the open audit reports '''
+        return self.get_bash_command(VenvTag.operators, OpCommand.audit_report_update)
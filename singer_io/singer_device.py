@@ -9,13 +9,53 @@ import os
 import json
 import subprocess
 import logging
+import threading
 
 from utils.venv_tool import VenvTag, VenvTool
-from utils.aws import s3
-from typing import Tuple
+from utils.aws import s3, s3_batch
+from typing import Callable, List, Optional, Tuple, Union
 from enum import Enum
 from datetime import datetime
 
+# bytes read from the end of a state file to find its last state, widened as needed
+state_tail_size = 4096
+# state versions kept in s3 per tap, older versions are expired after each run
+state_versions_kept = 10
+latest_state_version = 'latest'
+
+
+def last_line(read_tail: Callable[[int], Optional[Tuple[bytes, int]]]) -> bytes:
+    ''' Last non empty line of a file read from its end. read_tail gets the last
+    length bytes and the file size, or None when there is no file, and the read is
+    widened until it holds a complete last line. '''
+    length = state_tail_size
+    while True:
+        tail = read_tail(length)
+        if tail is None:
+            return bytes()
+
+        data, size = tail
+        lines = data.rstrip(b'\n')
+        line_start = lines.rfind(b'\n') + 1
+        if line_start or len(data) >= size:
+            return lines[line_start:]
+
+        length *= 4
+
+
+def read_file_tail(file_path: str) -> Callable[[int], Optional[Tuple[bytes, int]]]:
+    ''' Tail reader of a local file for last_line '''
+    def read_tail(length: int) -> Optional[Tuple[bytes, int]]:
+        if not os.path.exists(file_path):
+            return None
+
+        with open(file_path, 'rb') as s_file:
+            size = s_file.seek(0, os.SEEK_END)
+            s_file.seek(max(size - length, 0))
+            return s_file.read(), size
+
+    return read_tail
+
 
 class SProp(Enum):
     ''' Singer properties '''
@@ -86,30 +126,47 @@ class SingerDevice(object):
 
         return full_path
 
+    def get_key(self, sprop: SProp, version: Optional[str] = None) -> str:
+        ''' S3 key of a singer property file, or of one of its versions, which are
+        kept in a folder named after the property file '''
+        s3_folder, prop_name, _ = self.get_prop_details(sprop)
+        if version is None:
+            return '/'.join([s3_folder, prop_name])
+
+        return '/'.join([s3_folder, os.path.splitext(prop_name)[0], version + '.json'])
+
     def get_latest_state(self) -> dict:
-        ''' Pulls the most recent state object if one exists '''
-        data = self.download(SProp.state)
-        states = [s for s in data.decode('utf-8').split('\n') if s]
-        return json.loads(states[-1]) if states else {}
+        ''' Pulls the most recent state object if one exists, from the version named
+        by the latest state pointer. Taps without versions fall back to the end of
+        the state file, reading only its last line. If the pointed version is gone
+        (e.g. expired by a concurrent run) the newest saved version is used, and a
+        RuntimeError is raised if there is none rather than resyncing everything. '''
+        pointer = self.download(SProp.state, latest_state_version)
+        if pointer:
+            version = json.loads(pointer)['version']
+            state = self.download(SProp.state, version)
+            if not state:
+                for fallback in reversed(StateStore(self).versions()):
+                    logging.warning(f'Singer state version {version} is missing, using version {fallback}')
+                    state = self.download(SProp.state, fallback)
+                    if state:
+                        break
+                else:
+                    raise RuntimeError(f'Singer state version {version} is missing and no other version exists')
+        else:
+            key = self.get_key(SProp.state)
+            state = last_line(lambda length: s3.get_tail(key, length))
 
-    def download(self, sprop: SProp) -> bytes:
-        ''' Download singer property file from s3 '''
-        s3_folder, prop_name, _ = self.get_prop_details(sprop)
-        key = '/'.join([s3_folder, prop_name])
-        stream = s3.get_object(key)
-        data = bytes()
-        if stream:
-            for s in stream:
-                data += s
+        return json.loads(state.decode('utf-8')) if state else {}
 
-        return data
+    def download(self, sprop: SProp, version: Optional[str] = None) -> Union[bytes, bytearray]:
+        ''' Download singer property file from s3 '''
+        return s3.get_bytes(self.get_key(sprop, version)) or bytes()
 
-    def upload(self, sprop: SProp, file_path: str) -> None:
+    def upload(self, sprop: SProp, file_path: str, version: Optional[str] = None) -> None:
         ''' Upload singer propery file to s3 '''
-        s3_folder, prop_name, _ = self.get_prop_details(sprop)
-        key = '/'.join([s3_folder, prop_name])
         with open(file_path) as s_file:
-            s3.upload_object(key, s_file.read())
+            s3.upload_object(self.get_key(sprop, version), s_file.read())
 
     def setup_command_part(self, setup_path: str) -> str:
         ''' Get migration command for singer device
@@ -127,6 +184,60 @@ class SingerDevice(object):
         return ' '.join(command_list)
 
 
+class StateStore(object):
+    ''' Versioned singer state of a tap.
+    Each run uploads only its final state as a new version named by its UTC time,
+    then replaces a small pointer object naming the latest version, so uploads and
+    reads stay the same size however many runs there have been. Versions beyond
+    keep are expired on a background thread after each save.
+    '''
+
+    def __init__(self, device: SingerDevice, keep: int = state_versions_kept):
+        self.device = device
+        self.keep = max(keep, 1)
+        self.expiry: Optional[threading.Thread] = None
+
+    def versions(self) -> List[str]:
+        ''' Version names of the saved states, oldest first '''
+        prefix = os.path.dirname(self.device.get_key(SProp.state, latest_state_version)) + '/'
+        names = (item['Key'][len(prefix):-len('.json')] for item in s3.search(prefix))
+        return sorted(n for n in names if n != latest_state_version)
+
+    def save(self, state_file_path: str) -> Optional[str]:
+        ''' Upload the last state written to state_file_path as a new version, point
+        the latest state at it and start expiring old versions. Get the version, or
+        None when the run wrote no state. '''
+        state = last_line(read_file_tail(state_file_path))
+        if not state:
+            return None
+
+        version = datetime.utcnow().strftime('%Y%m%dT%H%M%S%fZ')
+        process_path, file_name = os.path.split(state_file_path)
+        final_path = os.path.join(process_path, 'final_' + file_name)
+        with open(final_path, 'wb') as s_file:
+            s_file.write(state + b'\n')
+        self.device.upload(SProp.state, final_path, version)
+
+        pointer_path = os.path.join(process_path, 'latest_' + file_name)
+        with open(pointer_path, 'w') as s_file:
+            json.dump({'version': version}, s_file)
+        self.device.upload(SProp.state, pointer_path, latest_state_version)
+
+        self.expiry = threading.Thread(target=self.expire, name='singer-state-expiry')
+        self.expiry.start()
+        return version
+
+    def expire(self) -> int:
+        ''' Delete all but the newest keep versions and get the number deleted.
+        Failures are logged since old versions are only kept for recovery. '''
+        try:
+            expired = self.versions()[:-self.keep]
+            return s3_batch.delete_keys(self.device.get_key(SProp.state, v) for v in expired)
+        except Exception:
+            logging.exception('Failed to expire old singer state versions')
+            return 0
+
+
 def migrate(tap: SingerDevice, target: SingerDevice) -> None:
     ''' Migrate data from source sytem to target system '''
     module_name = tap.__module__.split('.')[-1]
@@ -167,4 +278,4 @@ def migrate(tap: SingerDevice, target: SingerDevice) -> None:
 
     if has_state:
         logging.info('Saving {} state.'.format(module_name))
-        tap.upload(SProp.state, state_file_path)
+        StateStore(tap).save(state_file_path)
@@ -1,14 +1,26 @@
+import inspect
+
 from argparse import ArgumentParser
-from typing import List
+from datetime import datetime
+from typing import Callable, Dict, List
 from operators.process import OpCommand
-from operators.audit_trail.audit_ops import generate_audit_report
+from operators.audit_trail.audit_ops import generate_audit_report, update_audit_reports, backfill_audit_reports
+from operators.audit_trail.report import ReportFormat
+from utils.aws.logs import LogSource
 
 
-command_map = {
-    OpCommand.audit_report: generate_audit_report
+command_map: Dict[OpCommand, Callable[..., None]] = {
+    OpCommand.audit_report: generate_audit_report,
+    OpCommand.audit_report_update: update_audit_reports,
+    OpCommand.audit_backfill: backfill_audit_reports
 }
 
 
+def parse_date(value: str) -> datetime:
+    ''' Parse YYYY-MM-DD command line dates '''
+    return datetime.strptime(value, '%Y-%m-%d')
+
+
 def parse(args: List[str]) -> None:
     ''' Run operator process '''
     parser = ArgumentParser(
@@ -18,10 +30,60 @@ def parse(args: List[str]) -> None:
 
     parser.add_argument(
         'command',
-        help="operator command"
+        help="operator command",
+        choices=[c.name for c in OpCommand]
+    )
+
+    parser.add_argument(
+        '-s', '--start',
+        help="First date (YYYY-MM-DD) for date range commands",
+        type=parse_date
+    )
+
+    parser.add_argument(
+        '-e', '--end',
+        help="Last date (YYYY-MM-DD) for date range commands",
+        type=parse_date
+    )
+
+    parser.add_argument(
+        '-w', '--workers',
+        help="Number of worker processes",
+        type=int
+    )
+
+    parser.add_argument(
+        '-f', '--formats',
+        help="Report output formats",
+        nargs='+',
+        choices=[f.value for f in ReportFormat]
+    )
+
+    parser.add_argument(
+        '--source',
+        help="Where log lines are read from",
+        choices=[s.value for s in LogSource]
     )
 
     command_args = parser.parse_args(args)
 
     cmd = command_map[OpCommand[command_args.command]]
-    cmd()
+    options = {
+        'start': command_args.start,
+        'end': command_args.end,
+        'workers': command_args.workers,
+        'formats': [ReportFormat(f) for f in command_args.formats] if command_args.formats else None,
+        'source': LogSource(command_args.source) if command_args.source else None
+    }
+    cmd_params = inspect.signature(cmd).parameters
+    cmd_kwargs = {k: v for k, v in options.items() if v is not None}
+
+    unsupported = [k for k in cmd_kwargs if k not in cmd_params]
+    if unsupported:
+        parser.error(f'{command_args.command} does not take: {", ".join(unsupported)}')
+
+    missing = [k for k, p in cmd_params.items() if p.default is p.empty and k not in cmd_kwargs]
+    if missing:
+        parser.error(f'{command_args.command} requires: {", ".join(missing)}')
+
+    cmd(**cmd_kwargs)
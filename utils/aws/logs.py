@@ -1,20 +1,31 @@
 """
 Module contains helper functions for extracting log data from aws
 """
-import boto3
+import json
+import logging
 import time
 
 from enum import Enum
-from datetime import datetime
-from utils.aws import s3
-from io import BytesIO
+from datetime import datetime, timedelta
+from utils.aws import s3, session
+from collections import deque
+from io import BufferedReader, BytesIO
 from gzip import GzipFile
-from typing import Iterator
+from typing import Any, BinaryIO, Deque, Iterable, Iterator, List, Optional, Pattern, Tuple, Union
 from datetime import timezone
+from concurrent.futures import Future, ThreadPoolExecutor
 
 
 log_archive_path = 'log-archive'
-client = boto3.client('logs')
+archive_retention = timedelta(days=3)
+# CloudWatch can take up to 12 hours to make log events available for export,
+# so an export only surely holds the logs up to this long before it started
+export_lag = timedelta(hours=12)
+prefetch_workers = 4
+prefetch_memory_limit = 256 * 1024 * 1024
+
+# raw lines are kept if they contain the bytes or match the compiled bytes regex
+Prefilter = Union[bytes, Pattern[bytes]]
 
 
 class LogGroup(Enum):
@@ -25,18 +36,102 @@ class LogGroup(Enum):
 nodejs/nodejs.log'
 
 
+class LogSource(Enum):
+    ''' Ways of reading log lines '''
+
+    export = 'export'
+    filter = 'filter'
+
+
+def get_client() -> Any:
+    ''' Shared CloudWatch Logs client '''
+    return session.get_client('logs')
+
+
+def to_epoch_ms(dt: datetime) -> int:
+    ''' Milliseconds since epoch for a utc datetime '''
+    return int(dt.replace(tzinfo=timezone.utc).timestamp() * 1000)
+
+
+def manifest_prefix(archive_path: str = log_archive_path) -> str:
+    ''' S3 prefix of the manifest of completed log exports '''
+    return '/'.join([archive_path, 'manifest']) + '/'
+
+
+def manifest_key(task_id: str, archive_path: str = log_archive_path) -> str:
+    ''' S3 key of the manifest entry of a completed log export. Every export has
+    its own entry so concurrent runs never overwrite each other's exports. '''
+    return manifest_prefix(archive_path) + task_id + '.json'
+
+
+def load_manifest(bucket: Optional[str] = None, archive_path: str = log_archive_path) -> List[dict]:
+    ''' Get the completed log exports recorded for the archive path '''
+    exports = []
+    for item in s3.search(manifest_prefix(archive_path), bucket):
+        stream = s3.get_object(item['Key'], bucket)
+        # entries can be expired by another run while they are listed
+        if stream:
+            exports.append(json.loads(stream.read()))
+
+    return exports
+
+
+def record_export(export: dict, bucket: Optional[str] = None, archive_path: str = log_archive_path) -> None:
+    ''' Add a completed log export to the manifest of the archive path '''
+    s3.upload_object(manifest_key(export['task_id'], archive_path), json.dumps(export), bucket)
+
+
+def find_archive(exports: List[dict], log_group: LogGroup, utc_start: int, utc_end: int) -> Optional[dict]:
+    ''' Get the smallest recorded export of the log group that covers the time range.
+    A completed export is trusted for the range it was requested for, as it is when
+    it is first read, so a rerun reuses it instead of exporting again. Callers that
+    need every late log stay export_lag behind utc now (see audit_ops.source_lag). '''
+    covering = [
+        e for e in exports
+        if e['log_group'] == log_group.value and e['start'] <= utc_start and e['end'] >= utc_end
+    ]
+    return min(covering, key=lambda e: e['end'] - e['start'], default=None)
+
+
+def expire_archives(retention: timedelta = archive_retention, bucket: Optional[str] = None,
+                    archive_path: str = log_archive_path) -> None:
+    ''' Delete exported logs older than the retention period and drop them from the manifest '''
+    cutoff = datetime.utcnow() - retention
+    for export in load_manifest(bucket, archive_path):
+        if datetime.fromisoformat(export['created']) >= cutoff:
+            continue
+
+        task_prefix = '/'.join([archive_path, export['task_id']]) + '/'
+        s3.delete_objects((r['Key'] for r in s3.search(task_prefix, bucket, sharded=True)), bucket)
+        s3.delete_objects([manifest_key(export['task_id'], archive_path)], bucket)
+
+
 def archive_logs(
     log_group: LogGroup,
     start: datetime,
     end: datetime,
-    bucket: str = s3.default_bucket,
+    bucket: Optional[str] = None,
     archive_path: str = log_archive_path
 ) -> str:
-    ''' Archive logs from a specific log group to s3 withing a time range '''
-    utc_start = int(start.replace(tzinfo=timezone.utc).timestamp() * 1000)
-    utc_end = int(end.replace(tzinfo=timezone.utc).timestamp() * 1000)
+    ''' Archive logs from a specific log group to s3 withing a time range.
+    A completed export that covers the range is reused instead of exporting again,
+    so readers must filter lines to the range (see read_archive). '''
+    bucket = bucket or s3.get_default_bucket()
+    utc_start = to_epoch_ms(start)
+    utc_end = to_epoch_ms(end)
+
+    try:
+        expire_archives(bucket=bucket, archive_path=archive_path)
+    except RuntimeError:
+        # expired exports are only deleted to save space, the archive can still be read
+        logging.exception('Failed to expire old log exports')
+
+    archive = find_archive(load_manifest(bucket, archive_path), log_group, utc_start, utc_end)
+    if archive:
+        return archive['task_id']
 
-    export_resp = client.create_export_task(
+    created = datetime.utcnow()
+    export_resp = get_client().create_export_task(
         taskName='export_task',
         logGroupName=log_group.value,
         fromTime=utc_start,
@@ -45,36 +140,231 @@ def archive_logs(
         destinationPrefix=archive_path
     )
 
-    desc_resp = client.describe_export_tasks(taskId=export_resp['taskId'])
+    desc_resp = get_client().describe_export_tasks(taskId=export_resp['taskId'])
     status = desc_resp['exportTasks'][0]['status']['code']
-    pending_status = ['PENDING', 'PENDING_CANCEL']
+    pending_status = ['PENDING', 'PENDING_CANCEL', 'RUNNING']
     while status in pending_status:
         time.sleep(1)
-        desc_resp = client.describe_export_tasks(taskId=export_resp['taskId'])
+        desc_resp = get_client().describe_export_tasks(taskId=export_resp['taskId'])
         status = desc_resp['exportTasks'][0]['status']['code']
 
-    if status == 'FAILED':
-        message = "Log export failed for the following task id: {}".format(
+    if status != 'COMPLETED':
+        message = "Log export {} for the following task id: {}".format(
+            status.lower(),
             export_resp['taskId']
         )
         raise RuntimeError(message)
 
+    record_export({
+        'log_group': log_group.value,
+        'start': utc_start,
+        'end': utc_end,
+        'task_id': export_resp['taskId'],
+        'created': created.isoformat()
+    }, bucket, archive_path)
+
     return export_resp['taskId']
 
 
-def log_stream(log_group: LogGroup,
-               start: datetime, end: datetime) -> Iterator[str]:
-    ''' Get logs for a particular log group within a given time frame '''
+def export_archives(log_group: LogGroup, start: datetime, end: datetime) -> Iterator[dict]:
+    ''' Export logs for a log group to s3 (or reuse a covering export) and
+    get the s3 listing of the gz files, listed lazily one log stream folder
+    per request in parallel '''
     task_id = archive_logs(log_group, start, end)
-    log_prefix = '/'.join([log_archive_path, task_id])
-    search_response = s3.search(log_prefix)
-    logzfiles = [r['Key'] for r in search_response]
-    try:
-        for gzfile in logzfiles:
-            stream = s3.get_object(gzfile)
-            buffer = BytesIO(stream.read())
-            with GzipFile(fileobj=buffer) as gz_bytes:
-                for record in gz_bytes:
-                    yield record.decode('utf-8').strip()
-    finally:
-        s3.delete_objects(logzfiles)
+    log_prefix = '/'.join([log_archive_path, task_id]) + '/'
+    return s3.search(log_prefix, sharded=True)
+
+
+def export_logs(log_group: LogGroup, start: datetime, end: datetime) -> List[str]:
+    ''' Export logs for a log group to s3 (or reuse a covering export) and
+    get the keys of the gz files '''
+    return [r['Key'] for r in export_archives(log_group, start, end)]
+
+
+def line_time(dt: datetime) -> str:
+    ''' Timestamp prefix of an exported log line for a utc datetime '''
+    return dt.strftime('%Y-%m-%dT%H:%M:%S.') + f'{dt.microsecond // 1000:03d}Z'
+
+
+def scan_records(stream: BinaryIO, prefilter: Prefilter, chunk_size: int = 1024 * 1024) -> Iterator[bytes]:
+    ''' Get the raw lines of a stream that contain the prefilter bytes or regex match.
+    Whole chunks are searched so lines without a match are never split out. '''
+    if isinstance(prefilter, bytes):
+        def find(block: bytes, pos: int, end: int) -> int:
+            return block.find(prefilter, pos, end)
+    else:
+        def find(block: bytes, pos: int, end: int) -> int:
+            match = prefilter.search(block, pos, end)
+            return match.start() if match else -1
+
+    tail = b''
+    while True:
+        chunk = stream.read(chunk_size)
+        if not chunk:
+            break
+
+        block = tail + chunk
+        cut = block.rfind(b'\n') + 1
+        tail = block[cut:]
+        pos = find(block, 0, cut)
+        while pos != -1:
+            line_start = block.rfind(b'\n', 0, pos) + 1
+            line_end = block.find(b'\n', pos) + 1
+            yield block[line_start:line_end]
+            pos = find(block, line_end, cut)
+
+    if tail and find(tail, 0, len(tail)) != -1:
+        yield tail
+
+
+def archive_records(body: BinaryIO, start: Optional[datetime] = None, end: Optional[datetime] = None,
+                    prefilter: Optional[Prefilter] = None) -> Iterator[bytes]:
+    ''' Get raw, undecoded lines from a gz file body, decompressed as the body is read.
+    Lines are limited to [start, end) when a range is given and to the lines
+    passing the prefilter when one is given. '''
+    with GzipFile(fileobj=body) as gz_bytes:
+        stream = BufferedReader(gz_bytes, 1024 * 1024)
+        records = scan_records(stream, prefilter) if prefilter else stream
+        if start is None or end is None:
+            yield from records
+            return
+
+        # exported lines start with a fixed width iso timestamp so they compare as bytes
+        first, last = line_time(start).encode('ascii'), line_time(end).encode('ascii')
+        width = len(first)
+        for record in records:
+            if first <= record[:width] < last:
+                yield record
+
+
+def archive_lines(body: BinaryIO, start: Optional[datetime] = None, end: Optional[datetime] = None,
+                  prefilter: Optional[Prefilter] = None) -> Iterator[str]:
+    ''' Get log lines from a gz file body, decoding only the lines that pass the prefilter '''
+    for record in archive_records(body, start, end, prefilter):
+        yield record.decode('utf-8').strip()
+
+
+def read_archive(gzfile: str, start: Optional[datetime] = None, end: Optional[datetime] = None,
+                 prefilter: Optional[Prefilter] = None) -> Iterator[str]:
+    ''' Get log lines from a single exported gz file, streamed from s3 '''
+    yield from archive_lines(s3.get_object(gzfile), start, end, prefilter)
+
+
+def fetch_archive(gzfile: str) -> bytes:
+    ''' Download a gz file '''
+    return s3.get_object(gzfile).read()
+
+
+def prefetch_archives(archives: Iterable[dict], workers: int = prefetch_workers,
+                      memory_limit: int = prefetch_memory_limit) -> Iterator[BinaryIO]:
+    ''' Get the bodies of gz files in listing order. While one file is read, up to
+    `workers` of the following files are downloaded in the background as long as
+    the downloaded files held stay within memory_limit bytes; files that are not
+    prefetched are streamed from s3 when they are reached. The listing is read
+    only as far ahead as the prefetch needs. '''
+    listing = iter(archives)
+    upcoming: Deque[Tuple[dict, Optional[Future]]] = deque()
+    held = 0
+
+    with ThreadPoolExecutor(max_workers=max(workers, 1)) as pool:
+        try:
+            while True:
+                if not upcoming:
+                    archive = next(listing, None)
+                    if archive is None:
+                        break
+                    upcoming.append((archive, None))
+
+                archive, future = upcoming.popleft()
+                body = BytesIO(future.result()) if future else s3.get_object(archive['Key'])
+
+                while len(upcoming) < workers:
+                    following = next(listing, None)
+                    if following is None:
+                        break
+                    upcoming.append((following, None))
+
+                for i, (following, prefetch) in enumerate(upcoming):
+                    if prefetch is None:
+                        if held + following['Size'] > memory_limit:
+                            break
+                        upcoming[i] = (following, pool.submit(fetch_archive, following['Key']))
+                        held += following['Size']
+
+                yield body
+
+                if future:
+                    held -= archive['Size']
+        finally:
+            for _, prefetch in upcoming:
+                if prefetch:
+                    prefetch.cancel()
+
+
+def log_records(log_group: LogGroup, start: datetime, end: datetime,
+                prefilter: Optional[Prefilter] = None, workers: int = prefetch_workers,
+                memory_limit: int = prefetch_memory_limit) -> Iterator[bytes]:
+    ''' Get raw, undecoded log lines for a particular log group within a given
+    time frame, limited to the lines passing the prefilter when one is given '''
+    archives = export_archives(log_group, start, end)
+    for body in prefetch_archives(archives, workers, memory_limit):
+        yield from archive_records(body, start, end, prefilter)
+
+
+def log_stream(log_group: LogGroup, start: datetime, end: datetime,
+               prefilter: Optional[Prefilter] = None, workers: int = prefetch_workers,
+               memory_limit: int = prefetch_memory_limit) -> Iterator[str]:
+    ''' Get logs for a particular log group within a given time frame.
+    Exported files are kept for reuse until they pass the archive retention. '''
+    for record in log_records(log_group, start, end, prefilter, workers, memory_limit):
+        yield record.decode('utf-8').strip()
+
+
+def format_event(event: dict) -> str:
+    ''' Log event as a line in the format of exported logs '''
+    timestamp = datetime.fromtimestamp(event['timestamp'] / 1000, timezone.utc)
+    return f"{line_time(timestamp)} {event['message'].strip()}"
+
+
+def filter_events(log_group: LogGroup, start_ms: int, end_ms: int, filter_pattern: str,
+                  logs_client: Any) -> List[str]:
+    ''' Get every event matching the filter pattern in [start_ms, end_ms) as sorted log lines '''
+    events = []
+    request = {
+        'logGroupName': log_group.value,
+        'startTime': start_ms,
+        'endTime': end_ms - 1,
+        'filterPattern': filter_pattern
+    }
+
+    while True:
+        response = logs_client.filter_log_events(**request)
+        events += response.get('events', [])
+        if not response.get('nextToken'):
+            break
+        request['nextToken'] = response['nextToken']
+
+    events.sort(key=lambda e: (e['timestamp'], e.get('eventId', '')))
+    return [format_event(e) for e in events]
+
+
+def filtered_log_stream(log_group: LogGroup, start: datetime, end: datetime, filter_pattern: str,
+                        slices: int = 4, logs_client: Optional[Any] = None) -> Iterator[str]:
+    ''' Get log lines matching a CloudWatch filter pattern without exporting to s3.
+    The time window is split into slices that are paged through concurrently and
+    lines are yielded in time order, formatted like the lines of log_stream. '''
+    logs_client = logs_client or get_client()
+    utc_start = to_epoch_ms(start)
+    utc_end = to_epoch_ms(end)
+    edges = [utc_start + (utc_end - utc_start) * i // slices for i in range(slices + 1)]
+    bounds: List[Tuple[int, int]] = [(s, e) for s, e in zip(edges, edges[1:]) if e > s]
+    if not bounds:
+        return
+
+    with ThreadPoolExecutor(max_workers=len(bounds)) as pool:
+        futures = [
+            pool.submit(filter_events, log_group, s, e, filter_pattern, logs_client)
+            for s, e in bounds
+        ]
+        for future in futures:
+            yield from future.result()
@@ -2,13 +2,14 @@
 Module provides utility funcitons for getting meta data s3
 """
 
-import boto3
 import os
 
+from utils.aws import session
+
 
 def get_account_id() -> str:
     ''' Get aws account id '''
-    return boto3.client('sts').get_caller_identity()['Account']
+    return session.get_client('sts').get_caller_identity()['Account']
 
 
 def get_profile() -> str:
@@ -1,23 +1,50 @@
 """
 Module provide utility funcitons for interacting with AWS S3
 """
-import boto3
+import base64
+import hashlib
+import heapq
 import os
 
-from typing import Optional, Any, List
+from collections import deque
+from concurrent.futures import Executor, Future, ThreadPoolExecutor
+from typing import Optional, Any, BinaryIO, Callable, Deque, Dict, Iterable, Iterator, List, Tuple, Union
+from types import TracebackType
 from botocore.response import StreamingBody
 from botocore.errorfactory import ClientError
+from utils.aws import session
 
-default_bucket = '{}-reservoir'.format(
-    os.environ['ENV_NAME'].lower()
-)
-client = boto3.client('s3')
+
+min_part_size = 5 * 1024 * 1024
+default_part_size = 8 * 1024 * 1024
+transfer_workers = 8
+
+
+def get_default_bucket() -> str:
+    ''' Reservoir bucket of the current environment '''
+    return '{}-reservoir'.format(
+        os.environ['ENV_NAME'].lower()
+    )
+
+
+def __getattr__(name: str) -> Any:
+    ''' Resolve default_bucket when it is used so importing the module
+    doesn't need ENV_NAME '''
+    if name == 'default_bucket':
+        return get_default_bucket()
+
+    raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
+
+
+def get_client() -> Any:
+    ''' Shared s3 client '''
+    return session.get_client('s3')
 
 
 def exists(prefix: str, bucket: Optional[str] = None) -> bool:
     ''' Check to see if data exists for a particular prefix '''
-    bucket = bucket or default_bucket
-    response = client.list_objects_v2(
+    bucket = bucket or get_default_bucket()
+    response = get_client().list_objects_v2(
         Bucket=bucket,
         Prefix=prefix
     )
@@ -25,36 +52,52 @@ def exists(prefix: str, bucket: Optional[str] = None) -> bool:
     return 'Contents' in response
 
 
-def search(prefix: str, bucket: Optional[str] = None) -> list:
-    ''' Get list of items in s3 bucket with prefix '''
-    bucket = bucket or default_bucket
-    response = client.list_objects_v2(
-        Bucket=bucket,
-        Prefix=prefix
-    )
+def list_pages(prefix: str, bucket: str, **kwargs: Any) -> Iterator[dict]:
+    ''' list_objects_v2 responses for a prefix, following continuation tokens '''
+    request = dict(Bucket=bucket, Prefix=prefix, **kwargs)
+    while True:
+        response = get_client().list_objects_v2(**request)
+        yield response
+        if not response.get('IsTruncated'):
+            return
+        request['ContinuationToken'] = response['NextContinuationToken']
 
-    results = [item for item in response.get('Contents', [])]
 
-    while response['IsTruncated']:
-        token = response['IsTruncated']
-        response = client.list_objects_v2(
-            Bucket=bucket,
-            Prefix=prefix,
-            ContinuationToken=token
-        )
+def search(prefix: str, bucket: Optional[str] = None, sharded: bool = False,
+           workers: int = transfer_workers) -> Iterator[dict]:
+    ''' Get items in s3 bucket with prefix, listed lazily a page at a time.
+    With sharded the sub-prefixes one "/" level below prefix are found with a
+    delimiter listing and listed concurrently, and items are still yielded in
+    key order. '''
+    bucket = bucket or get_default_bucket()
+    if not sharded:
+        for response in list_pages(prefix, bucket):
+            yield from response.get('Contents', [])
+        return
+
+    items: List[dict] = []
+    shards: List[str] = []
+    for response in list_pages(prefix, bucket, Delimiter='/'):
+        items += response.get('Contents', [])
+        shards += [p['Prefix'] for p in response.get('CommonPrefixes', [])]
 
-        results += [item for item in response.get('Contents', [])]
+    def list_shard(shard: str) -> List[dict]:
+        return list(search(shard, bucket))
 
-    return results
+    # shards cover disjoint, ordered key ranges so only items directly under
+    # the prefix need merging in between them
+    with ThreadPoolExecutor(max_workers=max(workers, 1)) as pool:
+        shard_items = (item for listed in bounded_map(pool, list_shard, shards, workers) for item in listed)
+        yield from heapq.merge(items, shard_items, key=lambda item: item['Key'])
 
 
 def get_object(key: str, bucket: Optional[str] = None) -> StreamingBody:
     ''' Get s3 object '''
     stream = None
-    bucket = bucket or default_bucket
+    bucket = bucket or get_default_bucket()
 
     try:
-        stream = client.get_object(
+        stream = get_client().get_object(
             Bucket=bucket,
             Key=key
         )['Body']
@@ -65,24 +108,253 @@ def get_object(key: str, bucket: Optional[str] = None) -> StreamingBody:
     return stream
 
 
+def get_bytes(key: str, bucket: Optional[str] = None, chunk_size: int = 1024 * 1024) -> Optional[bytearray]:
+    ''' Get the content of an s3 object, read into a buffer preallocated to the
+    object size, or None if the object doesn't exist '''
+    bucket = bucket or get_default_bucket()
+    try:
+        response = get_client().get_object(Bucket=bucket, Key=key)
+    except ClientError as e:
+        if e.response['Error']['Code'] != 'NoSuchKey':
+            raise e
+        return None
+
+    buffer = bytearray(response['ContentLength'])
+    view = memoryview(buffer)
+    size = 0
+    for chunk in response['Body'].iter_chunks(chunk_size):
+        view[size:size + len(chunk)] = chunk
+        size += len(chunk)
+
+    return buffer
+
+
+def get_tail(key: str, length: int, bucket: Optional[str] = None) -> Optional[Tuple[bytes, int]]:
+    ''' Get the last length bytes of an s3 object (all of it when it is shorter)
+    and the object size, or None if the object doesn't exist '''
+    bucket = bucket or get_default_bucket()
+    try:
+        response = get_client().get_object(Bucket=bucket, Key=key, Range=f'bytes=-{length}')
+    except ClientError as e:
+        code = e.response['Error']['Code']
+        if code == 'NoSuchKey':
+            return None
+        if code == 'InvalidRange':
+            # ranges can't be satisfied for empty objects
+            return b'', 0
+        raise e
+
+    data = response['Body'].read()
+    content_range = response.get('ContentRange')
+    size = int(content_range.rpartition('/')[2]) if content_range else len(data)
+    return data, size
+
+
 def upload_object(key: str, data: Any, bucket: Optional[str] = None, public: bool = False) -> None:
     ''' Upload object to s3 '''
-    bucket = bucket or default_bucket
-    client.put_object(
+    bucket = bucket or get_default_bucket()
+    checksum = {'ContentMD5': content_md5(data)} if isinstance(data, (bytes, bytearray)) else {}
+    get_client().put_object(
         Body=data,
         Bucket=bucket,
         Key=key,
-        ACL='public-read' if public else 'private'
+        ACL='public-read' if public else 'private',
+        **checksum
     )
 
 
-def delete_objects(keys: List[str], bucket: Optional[str] = None) -> None:
-    ''' Delete objects from s3 '''
-    if keys:
-        bucket = bucket or default_bucket
-        client.delete_objects(
-            Bucket=bucket,
-            Delete={
-                'Objects': [{'Key': k} for k in keys]
-            }
+def content_md5(data: Union[bytes, bytearray]) -> str:
+    ''' Base64 md5 digest s3 uses to verify an uploaded body '''
+    return base64.b64encode(hashlib.md5(data).digest()).decode('ascii')
+
+
+def bounded_map(pool: Executor, fn: Callable, items: Iterable, limit: int) -> Iterator:
+    ''' Results of fn for each item in order, run on the pool with at most limit
+    calls in flight so unread results never pile up '''
+    pending: Deque[Future] = deque()
+    for item in items:
+        if len(pending) >= limit:
+            yield pending.popleft().result()
+        pending.append(pool.submit(fn, item))
+
+    while pending:
+        yield pending.popleft().result()
+
+
+class MultipartUpload(object):
+    ''' Writable s3 object that sends fixed size multipart upload parts as data
+    is written, so memory use is bounded by the part size rather than the object
+    size. Objects smaller than one part are sent with a single put_object.
+    With more than one worker parts are sent concurrently, at most two per worker
+    in flight. Every part carries its md5 for s3 to verify.
+    '''
+
+    def __init__(self, key: str, bucket: Optional[str] = None, public: bool = False,
+                 part_size: int = default_part_size, workers: int = 1):
+        self.key = key
+        self.bucket = bucket or get_default_bucket()
+        self.public = public
+        self.part_size = max(part_size, min_part_size)
+        self.buffer = bytearray()
+        self.upload_id = None
+        self.parts: List[dict] = []
+        self.part_count = 0
+        self.workers = workers
+        self.pool = ThreadPoolExecutor(max_workers=workers) if workers > 1 else None
+        self.pending: Deque[Future] = deque()
+
+    def write(self, data: bytes) -> None:
+        ''' Buffer data and upload every full part '''
+        self.buffer += data
+        while len(self.buffer) >= self.part_size:
+            self.upload_part(bytes(self.buffer[:self.part_size]))
+            del self.buffer[:self.part_size]
+
+    def upload_part(self, data: bytes) -> None:
+        ''' Upload the next part, starting the multipart upload if needed '''
+        if self.upload_id is None:
+            self.upload_id = get_client().create_multipart_upload(
+                Bucket=self.bucket,
+                Key=self.key,
+                ACL='public-read' if self.public else 'private'
+            )['UploadId']
+
+        self.part_count += 1
+        if self.pool is None:
+            self.parts.append(self.send_part(self.part_count, data))
+            return
+
+        if len(self.pending) >= 2 * self.workers:
+            self.parts.append(self.pending.popleft().result())
+        self.pending.append(self.pool.submit(self.send_part, self.part_count, data))
+
+    def send_part(self, part_number: int, data: bytes) -> dict:
+        ''' Send a part and get its entry for completing the upload '''
+        response = get_client().upload_part(
+            Body=data,
+            Bucket=self.bucket,
+            Key=self.key,
+            PartNumber=part_number,
+            UploadId=self.upload_id,
+            ContentMD5=content_md5(data)
         )
+        return {'ETag': response['ETag'], 'PartNumber': part_number}
+
+    def close(self) -> None:
+        ''' Upload the remaining data and complete the object '''
+        if self.upload_id is None:
+            upload_object(self.key, bytes(self.buffer), self.bucket, self.public)
+        else:
+            if self.buffer:
+                self.upload_part(bytes(self.buffer))
+            while self.pending:
+                self.parts.append(self.pending.popleft().result())
+            get_client().complete_multipart_upload(
+                Bucket=self.bucket,
+                Key=self.key,
+                UploadId=self.upload_id,
+                MultipartUpload={'Parts': self.parts}
+            )
+
+        self.buffer = bytearray()
+        if self.pool is not None:
+            self.pool.shutdown()
+
+    def abort(self) -> None:
+        ''' Abort the upload and discard any uploaded parts '''
+        for future in self.pending:
+            future.cancel()
+        if self.pool is not None:
+            self.pool.shutdown()
+        self.pending.clear()
+
+        if self.upload_id is not None:
+            get_client().abort_multipart_upload(
+                Bucket=self.bucket,
+                Key=self.key,
+                UploadId=self.upload_id
+            )
+
+        self.buffer = bytearray()
+
+    def __enter__(self) -> 'MultipartUpload':
+        return self
+
+    def __exit__(self, exc_type: Optional[type], exc: Optional[BaseException],
+                 tb: Optional[TracebackType]) -> None:
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+
+def upload_from(key: str, source: Union[BinaryIO, Iterable[bytes]], bucket: Optional[str] = None,
+                public: bool = False, part_size: int = default_part_size,
+                workers: int = transfer_workers) -> None:
+    ''' Upload a file object or an iterable of byte chunks as an s3 object, in
+    multipart parts of part_size sent concurrently on a pool of workers '''
+    chunks = iter(lambda: source.read(part_size), b'') if hasattr(source, 'read') else source
+    with MultipartUpload(key, bucket, public, part_size, workers) as upload:
+        for chunk in chunks:
+            upload.write(chunk)
+
+
+def download_to(key: str, target: Union[str, BinaryIO], bucket: Optional[str] = None,
+                part_size: int = default_part_size, workers: int = transfer_workers,
+                verify: bool = True) -> int:
+    ''' Download an s3 object to a file path or writable file object and get its size.
+    Multipart objects are fetched part by part and other objects in ranged GETs of
+    part_size, on a pool of workers, and written in order. Every request is pinned
+    to the object's ETag so a concurrent overwrite fails the download instead of
+    mixing versions, and with verify the data is checked against the ETag (the md5
+    of the object, or of the part md5s for multipart objects). ETags of objects
+    encrypted with KMS or customer keys are not md5s, so those aren't verified. '''
+    bucket = bucket or get_default_bucket()
+    head = get_client().head_object(Bucket=bucket, Key=key)
+    size = head['ContentLength']
+    etag = head.get('ETag', '').strip('"')
+    pinned = {'IfMatch': head['ETag']} if etag else {}
+    encrypted = head.get('ServerSideEncryption', '').startswith('aws:kms') or 'SSECustomerAlgorithm' in head
+    verify = verify and bool(etag) and not encrypted
+    requests: List[Dict[str, Any]]
+    if '-' in etag:
+        requests = [{'PartNumber': n} for n in range(1, int(etag.split('-')[1]) + 1)]
+    else:
+        requests = [
+            {'Range': f'bytes={start}-{min(start + part_size, size) - 1}'} for start in range(0, size, part_size)
+        ]
+
+    def fetch(request: dict) -> bytes:
+        return get_client().get_object(Bucket=bucket, Key=key, **request, **pinned)['Body'].read()
+
+    whole = hashlib.md5()
+    part_digests = []
+    file = open(target, 'wb') if isinstance(target, str) else target
+    try:
+        with ThreadPoolExecutor(max_workers=max(workers, 1)) as pool:
+            for data in bounded_map(pool, fetch, requests, 2 * max(workers, 1)):
+                file.write(data)
+                if verify and '-' in etag:
+                    part_digests.append(hashlib.md5(data).digest())
+                elif verify:
+                    whole.update(data)
+    finally:
+        if isinstance(target, str):
+            file.close()
+
+    if verify:
+        if '-' in etag:
+            actual = hashlib.md5(b''.join(part_digests)).hexdigest() + f'-{len(part_digests)}'
+        else:
+            actual = whole.hexdigest()
+        if actual != etag:
+            raise RuntimeError(f'Checksum mismatch downloading {key}: expected {etag}, got {actual}')
+
+    return size
+
+
+def delete_objects(keys: Iterable[str], bucket: Optional[str] = None) -> None:
+    ''' Delete objects from s3, in concurrent batches of up to 1000 keys '''
+    from utils.aws import s3_batch  # s3_batch is built on this module
+
+    s3_batch.delete_keys(keys, bucket)
@@ -0,0 +1,137 @@
+"""
+Module provides batched s3 delete and copy operations
+"""
+import time
+
+from botocore.errorfactory import ClientError
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+from typing import Iterable, Iterator, List, Optional, Tuple
+from utils.aws import s3
+
+max_batch_keys = 1000
+batch_workers = 8
+batch_attempts = 4
+
+
+def chunked(items: Iterable, size: int) -> Iterator[list]:
+    ''' Lists of up to size items '''
+    items = iter(items)
+    return iter(lambda: list(islice(items, size)), [])
+
+
+def backoff(attempt: int) -> None:
+    ''' Wait before retrying failed keys '''
+    time.sleep(0.2 * 2 ** attempt)
+
+
+def raise_errors(operation: str, errors: List[dict]) -> None:
+    ''' Raise for the keys an operation could not complete '''
+    if errors:
+        failed = ', '.join(f"{e['Key']} ({e.get('Code', '')})" for e in errors[:10])
+        raise RuntimeError(f'Failed to {operation} {len(errors)} s3 objects: {failed}')
+
+
+def delete_batch(keys: List[str], bucket: str, attempts: int = batch_attempts) -> Tuple[int, List[dict]]:
+    ''' Delete up to 1000 keys with one DeleteObjects request, retrying only the keys
+    that failed. Get the number of keys and the errors of keys that still failed. '''
+    key_count = len(keys)
+    errors: List[dict] = []
+    for attempt in range(attempts):
+        response = s3.get_client().delete_objects(
+            Bucket=bucket,
+            Delete={
+                'Objects': [{'Key': k} for k in keys],
+                'Quiet': True
+            }
+        )
+        errors = response.get('Errors', [])
+        if not errors:
+            break
+
+        keys = [e['Key'] for e in errors]
+        if attempt + 1 < attempts:
+            backoff(attempt)
+
+    return key_count, errors
+
+
+def delete_keys(keys: Iterable[str], bucket: Optional[str] = None, workers: int = batch_workers,
+                attempts: int = batch_attempts) -> int:
+    ''' Delete s3 objects in batches of 1000 keys sent concurrently and get the number
+    of keys deleted. Keys that fail are retried on their own and a RuntimeError
+    lists any that still fail. '''
+    bucket = bucket or s3.get_default_bucket()
+    workers = max(workers, 1)
+    key_count = 0
+    errors: List[dict] = []
+
+    def delete(batch: List[str]) -> Tuple[int, List[dict]]:
+        return delete_batch(batch, bucket, attempts)
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for batch_count, batch_errors in s3.bounded_map(pool, delete, chunked(keys, max_batch_keys), 2 * workers):
+            key_count += batch_count
+            errors += batch_errors
+
+    raise_errors('delete', errors)
+    return key_count
+
+
+def copy_key(key: str, dest_key: str, bucket: str, dest_bucket: str,
+             attempts: int = batch_attempts) -> Optional[dict]:
+    ''' Server side copy of an object, retried on failure. Get the error if every
+    attempt failed. '''
+    for attempt in range(attempts):
+        try:
+            s3.get_client().copy_object(
+                Bucket=dest_bucket,
+                Key=dest_key,
+                CopySource={'Bucket': bucket, 'Key': key}
+            )
+            return None
+        except ClientError as e:
+            error = {'Key': key, 'Code': e.response['Error']['Code']}
+            if e.response['Error']['Code'] in ('NoSuchKey', 'AccessDenied'):
+                return error
+            if attempt + 1 < attempts:
+                backoff(attempt)
+
+    return error
+
+
+def copy_keys(copies: Iterable[Tuple[str, str]], bucket: Optional[str] = None,
+              dest_bucket: Optional[str] = None, workers: int = batch_workers,
+              attempts: int = batch_attempts) -> int:
+    ''' Server side copy of (key, dest_key) pairs, sent concurrently, and get the
+    number of objects copied. A RuntimeError lists any keys that fail every attempt. '''
+    bucket = bucket or s3.get_default_bucket()
+    dest_bucket = dest_bucket or bucket
+    workers = max(workers, 1)
+    copy_count = 0
+    errors: List[dict] = []
+
+    def copy(pair: Tuple[str, str]) -> Optional[dict]:
+        return copy_key(pair[0], pair[1], bucket, dest_bucket, attempts)
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for error in s3.bounded_map(pool, copy, copies, 4 * workers):
+            if error:
+                errors.append(error)
+            else:
+                copy_count += 1
+
+    raise_errors('copy', errors)
+    return copy_count
+
+
+def move_prefix(prefix: str, dest_prefix: str, bucket: Optional[str] = None,
+                dest_bucket: Optional[str] = None, workers: int = batch_workers) -> int:
+    ''' Copy every object under prefix to dest_prefix, then delete the originals,
+    and get the number of objects moved (e.g. to archive a log export instead of
+    deleting it) '''
+    keys = [item['Key'] for item in s3.search(prefix, bucket, sharded=True, workers=workers)]
+    copies = ((k, dest_prefix + k[len(prefix):]) for k in keys)
+    moved = copy_keys(copies, bucket, dest_bucket, workers)
+    delete_keys(keys, bucket, workers)
+    return moved
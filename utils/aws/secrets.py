@@ -2,19 +2,38 @@
 Module that provides utility functions for getting aws secrets
 """
 
-import boto3
 import json
+import threading
+import time
 
-client = boto3.client('secretsmanager')
+from utils.aws import session
+from typing import Any, Dict, Tuple
 
+secret_ttl = 300
+_secret_cache: Dict[str, Tuple[float, dict]] = {}
+_secret_lock = threading.Lock()
+
+
+def get_client() -> Any:
+    ''' Shared secrets manager client '''
+    return session.get_client('secretsmanager')
+
+
+def fetch_secret(secret_id: str, ttl: float = secret_ttl) -> dict:
+    ''' Get aws secrets, cached in process for ttl seconds '''
+    with _secret_lock:
+        cached = _secret_cache.get(secret_id)
+    if cached and time.monotonic() - cached[0] < ttl:
+        return dict(cached[1])
 
-def fetch_secret(secret_id: str) -> dict:
-    ''' Get aws secrets '''
     secret = {}
-    response = client.get_secret_value(
+    response = get_client().get_secret_value(
         SecretId=secret_id
     )
     if response is not None:
         secret = json.loads(response['SecretString'])
 
-    return secret
+    with _secret_lock:
+        _secret_cache[secret_id] = (time.monotonic(), secret)
+
+    return dict(secret)
@@ -0,0 +1,51 @@
+"""
+Module provides shared boto3 clients for the aws utility modules
+"""
+import boto3
+import os
+import threading
+
+from botocore.config import Config
+from typing import Any, Dict, Optional, Tuple
+
+max_pool_connections = int(os.environ.get('aws_max_pool_connections', '32'))
+retries = {'max_attempts': 10, 'mode': 'adaptive'}
+
+_sessions: Dict[int, boto3.session.Session] = {}
+_clients: Dict[Tuple[int, str], Any] = {}
+_overrides: Dict[str, Any] = {}
+_lock = threading.Lock()
+
+
+def client_config() -> Config:
+    ''' Botocore config shared by every client '''
+    return Config(max_pool_connections=max_pool_connections, retries=retries)
+
+
+def get_client(service: str) -> Any:
+    ''' Get the shared client for an aws service, created on first use.
+    Clients are kept per process id since they can't be shared with forked
+    processes, and are safe to use from several threads at once. '''
+    if service in _overrides:
+        return _overrides[service]
+
+    key = (os.getpid(), service)
+    client = _clients.get(key)
+    if client is None:
+        with _lock:
+            if key not in _clients:
+                if key[0] not in _sessions:
+                    _sessions[key[0]] = boto3.session.Session()
+                _clients[key] = _sessions[key[0]].client(service, config=client_config())
+            client = _clients[key]
+
+    return client
+
+
+def set_client(service: str, client: Optional[Any]) -> None:
+    ''' Use a replacement client for an aws service (e.g. an offline stand-in),
+    or go back to the shared client when client is None '''
+    if client is None:
+        _overrides.pop(service, None)
+    else:
+        _overrides[service] = client
@@ -1,29 +1,241 @@
 """
 Pull db data
 """
-import psycopg2
 import os
+import threading
+import uuid
 
+from collections import namedtuple
+from contextlib import contextmanager
+from enum import Enum
+from functools import lru_cache
+from io import StringIO
+from itertools import islice
+from psycopg2 import sql
+from psycopg2.extensions import connection
+from psycopg2.pool import ThreadedConnectionPool
 from utils.aws import secrets
-from typing import Iterable
+from types import TracebackType
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Sequence, Union
 
 
-def customer_pipelines(table: str, batch_size: int = 10000) -> Iterable:
-    ''' Get table/view data from custmers.pipelines schema '''
-    secret_key = 'bastille/app/businesslogicapi/CustomerDB'
-    db_details = secrets.fetch_secret(secret_key)
+customer_db_secret = 'bastille/app/businesslogicapi/CustomerDB'
+max_pool_connections = 8
+copy_chunk_size = 100000
+_pools: Dict[int, ThreadedConnectionPool] = {}
+_pool_lock = threading.Lock()
+
+
+class RowFormat(Enum):
+    ''' Shapes of the rows returned by customer_pipelines '''
+
+    dict = 'dict'
+    tuple = 'tuple'
+    namedtuple = 'namedtuple'
+
+
+@lru_cache(maxsize=None)
+def customer_db_dsn() -> str:
+    ''' Connection string for the customer db, built once per process '''
+    db_details = secrets.fetch_secret(customer_db_secret)
     database = os.environ.get('customer_db', db_details['database'])
     user = os.environ.get('customer_db_user', db_details['user'])
     host = os.environ.get('customer_db_host', db_details['host'])
     password = os.environ.get('customer_db_password', db_details['password'])
+    return f"dbname='{database}' user='{user}' host='{host}' password='{password}'"
+
+
+def customer_db_pool() -> ThreadedConnectionPool:
+    ''' Connection pool for the customer db. Pools are kept per process id so
+    forked processes never share a parent's connections. '''
+    pid = os.getpid()
+    with _pool_lock:
+        if pid not in _pools:
+            _pools[pid] = ThreadedConnectionPool(1, max_pool_connections, customer_db_dsn())
+
+        return _pools[pid]
+
+
+@contextmanager
+def customer_db() -> Iterator[connection]:
+    ''' Borrow a pooled customer db connection. The transaction is committed when
+    the block exits cleanly and rolled back otherwise. '''
+    pool = customer_db_pool()
+    conn = pool.getconn()
+    try:
+        yield conn
+        conn.commit()
+    except Exception:
+        if not conn.closed:
+            conn.rollback()
+        raise
+    finally:
+        pool.putconn(conn, close=bool(conn.closed))
+
+
+def row_maker(row_format: RowFormat, table: str, desc: List[str]) -> Callable[[list], list]:
+    ''' Function converting a batch of fetched tuples to the row format '''
+    if row_format == RowFormat.tuple:
+        return lambda batch: batch
+
+    if row_format == RowFormat.namedtuple:
+        # the row type is built from the query's columns, which mypy can't check
+        row_type = namedtuple(f'{table}_row', desc, rename=True)  # type: ignore[misc]
+        return lambda batch: list(map(row_type._make, batch))
+
+    return lambda batch: [dict(zip(desc, qd)) for qd in batch]
+
+
+def customer_pipelines(table: str, batch_size: int = 10000, where: Optional[str] = None,
+                       params: Sequence = (), columns: Optional[Sequence[str]] = None,
+                       row_format: Union[RowFormat, str] = RowFormat.dict) -> Iterable:
+    ''' Get table/view data from custmers.pipelines schema, optionally limited to
+    some columns and by a where clause with %s placeholders for params. Rows are
+    streamed with a server-side cursor batch_size rows at a time, as dicts,
+    tuples or namedtuples. '''
+    row_format = RowFormat(row_format)
     pipelines_schema = os.environ.get('pipelines_schema', 'pipelines')
-    conn_str = f"dbname='{database}' user='{user}' host='{host}' password='{password}'"
-    query = f'SELECT * FROM {pipelines_schema}.{table}'
-    conn = psycopg2.connect(conn_str)
-    cursor = conn.cursor()
-    cursor.execute(query)
-    desc = [q.name for q in cursor.description]
-    records = [{i: x for i, x in zip(desc, qd)} for qd in cursor.fetchmany(batch_size)]
-    while records:
-        yield records
-        records = [{i: x for i, x in zip(desc, qd)} for qd in cursor.fetchmany(batch_size)]
+    query = sql.SQL('SELECT {} FROM {}.{}').format(
+        sql.SQL(', ').join(map(sql.Identifier, columns)) if columns else sql.SQL('*'),
+        sql.Identifier(pipelines_schema),
+        sql.Identifier(table)
+    )
+    if where:
+        query += sql.SQL(' WHERE ') + sql.SQL(where)
+
+    with customer_db() as conn:
+        with conn.cursor(name=f'{table}_{uuid.uuid4().hex}') as cursor:
+            cursor.itersize = batch_size
+            cursor.execute(query, params or None)
+            batch = cursor.fetchmany(batch_size)
+            # a named cursor only has a description once rows have been fetched
+            make_rows = row_maker(row_format, table, [q.name for q in cursor.description])
+            while batch:
+                yield make_rows(batch)
+                batch = cursor.fetchmany(batch_size)
+
+
+def copy_value(value: Any) -> str:
+    ''' Field of a COPY text format row '''
+    if value is None:
+        return '\\N'
+
+    return (str(value).replace('\\', '\\\\').replace('\t', '\\t')
+            .replace('\n', '\\n').replace('\r', '\\r'))
+
+
+def table_identifier(table: str, schema: Optional[str] = None) -> sql.Identifier:
+    ''' Qualified identifier of a customer db table, in the pipelines schema by default '''
+    return sql.Identifier(schema or os.environ.get('pipelines_schema', 'pipelines'), table)
+
+
+def create_table_query(table: sql.Identifier, columns: Sequence[str], column_types: Sequence[str]) -> sql.Composed:
+    ''' CREATE TABLE IF NOT EXISTS statement for the columns and their types '''
+    return sql.SQL('CREATE TABLE IF NOT EXISTS {} ({})').format(
+        table,
+        sql.SQL(', ').join(
+            sql.SQL('{} {}').format(sql.Identifier(c), sql.SQL(t)) for c, t in zip(columns, column_types)
+        )
+    )
+
+
+def create_table(table: str, columns: Sequence[str], column_types: Sequence[str],
+                 schema: Optional[str] = None) -> None:
+    ''' Create a customer db table if it doesn't exist. Run this once before
+    concurrent loads, since concurrent CREATE TABLE IF NOT EXISTS statements can
+    fail on the catalog when the table is new. '''
+    with customer_db() as conn:
+        with conn.cursor() as cursor:
+            cursor.execute(create_table_query(table_identifier(table, schema), columns, column_types))
+
+
+class CopyLoader(object):
+    ''' Bulk loads rows into a customer db table with COPY FROM STDIN.
+    Rows are encoded in chunks of chunk_size and every chunk is copied on the same
+    connection, so the whole load is one transaction that is committed on close.
+    The table is created if column types are given, and rows matching the replace
+    clause are deleted first so a load can be rerun without duplicating rows.
+    '''
+
+    def __init__(self, table: str, columns: Sequence[str], column_types: Optional[Sequence[str]] = None,
+                 replace_where: Optional[str] = None, replace_params: Sequence = (),
+                 schema: Optional[str] = None, chunk_size: int = copy_chunk_size):
+        self.table = table_identifier(table, schema)
+        self.columns = sql.SQL(', ').join(map(sql.Identifier, columns))
+        self.chunk_size = chunk_size
+        self.rows: List[Sequence] = []
+        self.row_count = 0
+        self.pool = customer_db_pool()
+        self.conn = self.pool.getconn()
+        self.cursor = self.conn.cursor()
+
+        try:
+            if column_types:
+                self.cursor.execute(create_table_query(self.table, columns, column_types))
+
+            if replace_where:
+                query = sql.SQL('DELETE FROM {} WHERE ').format(self.table) + sql.SQL(replace_where)
+                self.cursor.execute(query, replace_params or None)
+        except Exception:
+            self.abort()
+            raise
+
+    def write(self, rows: Iterable[Sequence]) -> None:
+        ''' Add rows (tuples or NamedTuples in column order) to the load '''
+        self.rows.extend(rows)
+        if len(self.rows) >= self.chunk_size:
+            self.flush()
+
+    def flush(self) -> None:
+        ''' Copy the buffered rows to the table '''
+        if not self.rows:
+            return
+
+        buffer = StringIO()
+        buffer.writelines('\t'.join(map(copy_value, row)) + '\n' for row in self.rows)
+        buffer.seek(0)
+        query = sql.SQL('COPY {} ({}) FROM STDIN').format(self.table, self.columns)
+        self.cursor.copy_expert(query, buffer)
+        self.row_count += len(self.rows)
+        self.rows = []
+
+    def close(self) -> None:
+        ''' Copy the remaining rows and commit the load '''
+        try:
+            self.flush()
+            self.conn.commit()
+        except Exception:
+            self.abort()
+            raise
+
+        self.cursor.close()
+        self.pool.putconn(self.conn)
+
+    def abort(self) -> None:
+        ''' Roll back the load '''
+        self.rows = []
+        if not self.conn.closed:
+            self.conn.rollback()
+        self.pool.putconn(self.conn, close=bool(self.conn.closed))
+
+    def __enter__(self) -> 'CopyLoader':
+        return self
+
+    def __exit__(self, exc_type: Optional[type], exc: Optional[BaseException],
+                 tb: Optional[TracebackType]) -> None:
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+
+def copy_records(table: str, records: Iterable[Sequence], columns: Sequence[str], **kwargs) -> int:
+    ''' Bulk load records (tuples or NamedTuples) into a customer db table in one
+    transaction and get the number of rows loaded. Keyword arguments are passed to
+    CopyLoader. '''
+    records = iter(records)
+    with CopyLoader(table, columns, **kwargs) as loader:
+        for chunk in iter(lambda: list(islice(records, loader.chunk_size)), []):
+            loader.write(chunk)
+
+    return loader.row_count